@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+""" Offline throughput benchmarks, using a local mock of GitHub API.
+
+    python benchmark.py [--latency SECONDS] [--tokens N]
+
+Latency is added to every response of the mock server; the default is close
+to a typical round trip to api.github.com.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import stscraper
+from stscraper.mockserver import MockGitHub
+import repo_info_crawler
+
+
+class Benchmark(object):
+    """ Measure requests, pages and records per second of a code block """
+    def __init__(self, name, server):
+        self.name = name
+        self.server = server
+        self.records = 0
+
+    def __enter__(self):
+        self.requests = self.server.requests
+        self.pages = self.server.pages
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.time() - self.started
+        requests = self.server.requests - self.requests
+        pages = self.server.pages - self.pages
+        print('%-32s %8.1f req/s %8.1f pages/s %10.1f records/s %8.2fs' % (
+            self.name, requests / elapsed, pages / elapsed,
+            self.records / elapsed, elapsed))
+
+
+def bench_request(server, tokens):
+    api = server.api(stscraper.GitHubAPI, tokens)
+    with Benchmark('request, sequential pages', server) as b:
+        b.records = sum(1 for _ in api.repo_commits('bench/repo'))
+    with Benchmark('request, prefetch=2', server) as b:
+        b.records = sum(1 for _ in api.repo_commits('bench/repo', prefetch=2))
+    with Benchmark('request, concurrency=8', server) as b:
+        b.records = sum(
+            1 for _ in api.repo_commits('bench/repo', concurrency=8))
+
+
+def bench_v4(server, tokens):
+    api = server.api(stscraper.GitHubAPIv4, tokens)
+    with Benchmark('v4, sequential pages', server) as b:
+        b.records = sum(1 for _ in api.user_followers('user'))
+    slugs = ['bench/repo%d' % i for i in range(1000)]
+    with Benchmark('v4, batch_repo_info', server) as b:
+        b.records = sum(1 for _ in api.batch_repo_info(slugs))
+
+
+def bench_bulk(server, tokens):
+    api = server.api(stscraper.GitHubAPI, tokens)
+    slugs = ['bench/repo%d' % i for i in range(500)]
+    with Benchmark('bulk repo_info, concurrency=16', server) as b:
+        b.records = sum(1 for _ in api.bulk(api.repo_info, slugs, 16))
+
+    tempdir = tempfile.mkdtemp()
+    stdout = sys.stdout
+    try:
+        output = os.path.join(tempdir, 'repos.csv')
+        with Benchmark('repo_info_crawler', server) as b:
+            sys.stdout = open(os.devnull, 'w')  # silence crawler progress
+            repo_info_crawler.crawl_repo_info(slugs, api, output)
+            sys.stdout.close()
+            sys.stdout = stdout
+            b.records = len(slugs)
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(tempdir)
+
+
+def bench_json(server, pages=200):
+    """ Decoding of a 100-issue page, without network """
+    import requests
+    response = requests.Response()
+    response._content = json.dumps(
+        [server._item('bench/repo', 'issues', i) for i in range(100)]
+    ).encode('utf8')
+    with Benchmark('json, response.json()', server) as b:
+        for _ in range(pages):
+            response.json()
+        b.records = pages * 100
+    for name, decoder in stscraper.json_decoders().items():
+        with Benchmark('json, %s from bytes' % name, server) as b:
+            for _ in range(pages):
+                decoder(response.content)
+            b.records = pages * 100
+
+
+def bench_records(server, pages=100):
+    """ Memory used by decoded commits, without network """
+    try:
+        import tracemalloc
+    except ImportError:  # Python 2
+        return
+    from stscraper.records import Commit
+    payload = json.dumps(
+        [server._item('bench/repo', 'commits', i) for i in range(100)])
+
+    def measure(name, extract):
+        tracemalloc.start()
+        records = [extract(commit) for _ in range(pages)
+                   for commit in json.loads(payload)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print('%-32s %8.0f bytes/record' % (name, size / len(records)))
+
+    measure('commits, dict', lambda commit: commit)
+    mapping = stscraper.compile_mapping({
+        'sha': 'sha', 'author': 'author__login',
+        'authored_at': 'commit__author__date', 'parents': 'parents__,sha'})
+    measure('commits, compile_mapping', mapping)
+    measure('commits, Commit.from_json', Commit.from_json)
+
+
+def bench_token_rotation(server, tokens=60):
+    """ Scheduler overhead, without network """
+    tokens = [stscraper.GitHubAPIToken('%040d' % i) for i in range(tokens)]
+    for token in tokens:
+        token.limits['core'] = {
+            'remaining': 5000, 'limit': 5000, 'reset': server.reset}
+    scheduler = stscraper.TokenScheduler(tokens)
+    with Benchmark('token rotation (picks)', server) as b:
+        for _ in range(100000):
+            scheduler.pick('repos/bench/repo')
+        b.records = 100000
+
+
+def bench_import(runs=10):
+    """ Startup cost of short-lived scripts, e.g. check_gh_limits """
+    for statement in ('pass', 'import stscraper'):
+        started = time.time()
+        for _ in range(runs):
+            subprocess.check_call([sys.executable, '-c', statement])
+        elapsed = (time.time() - started) * 1000 / runs
+        print('%-32s %8.1f ms' % ('python -c "%s"' % statement, elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark stscraper against a local mock of GitHub API")
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help="response latency in seconds, default: 0.02")
+    parser.add_argument('--tokens', type=int, default=8,
+                        help="number of API tokens, default: 8")
+    parser.add_argument('--items', type=int, default=3000,
+                        help="records per paginated list, default: 3000")
+    args = parser.parse_args()
+
+    with MockGitHub(latency=args.latency, items=args.items,
+                    quota=10**6) as server:
+        for bench in (bench_request, bench_v4, bench_bulk):
+            bench(server, args.tokens)
+        bench_token_rotation(server)
+        bench_json(server)
+        bench_records(server)
+    bench_import()
+
+
+if __name__ == '__main__':
+    main()
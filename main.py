@@ -7,8 +7,6 @@ from typing import Iterable
 from random import randint
 import os.path
 import logging
-import os.path
-import pandas as pd
 import datetime as dt
 import math
 import repo_info_crawler
@@ -27,6 +25,7 @@ d29e30994dd536ea72e08591f924bd20e2f2b1b3')
 #     res = token.check_limits()
 #     print(res)
 
+    import pandas as pd  # only needed to read the input list
     all_ = pd.read_csv('data/missed.csv')
 
     repo_info_crawler.get_updated_pushed_topic_star_fork_issue_count(all_, api)
@@ -44,5 +44,9 @@ setup(
     packages=[package],
     url='https://github.com/cmustrudel/strudel.scraper',
     install_requires=requirements,
+    extras_require={
+        'async': ['httpx'],
+        'parquet': ['pyarrow'],
+    },
     **kwargs
 )
@@ -0,0 +1,328 @@
+""" Asyncio interface to GitHub API.
+
+Requires Python 3.6+ and httpx (`pip install strudel.scraper[async]`).
+It is not imported by `stscraper` itself, so use it explicitly:
+
+    >>> from stscraper.aio import AsyncGitHubAPI
+    >>> async def main():
+    ...     async with AsyncGitHubAPI() as api:
+    ...         info = await api.repo_info('pandas-dev/pandas')
+    ...         async for issue in api.repo_issues('pandas-dev/pandas'):
+    ...             pass
+"""
+
+import asyncio
+from datetime import datetime
+import json
+import time
+
+import requests
+
+try:
+    import httpx
+except ImportError:  # optional dependency
+    httpx = None
+
+from .base import CircuitOpen, RepoDoesNotExist, TokenNotReady, VCSError, \
+    _NotFound, json_path, projection
+from .metrics import endpoint_class
+from .quota import token_id
+from .github import GitHubAPI, GitHubAPIv4, parse_graphql_path
+
+_MISSING = object()  # default of cache lookups, cached values can be None
+
+
+class AsyncGitHubAPI(object):
+    """ Non-blocking counterpart of GitHubAPI
+
+    It wraps a GitHubAPI instance and uses its token pool, so rate limits are
+    shared with the synchronous interface. All API methods decorated with
+    `@api` are available with the same arguments: single-object methods
+    (e.g. `repo_info`) return coroutines and paginated ones (e.g.
+    `repo_issues`) return async generators.
+
+    Network errors are reported with the same exceptions as in GitHubAPI.
+    The response cache, `dedup` and `memo` of the wrapped instance are used
+    the same way, and shared with the synchronous interface.
+    """
+
+    def __init__(self, tokens=None, timeout=30, api=None, client=None,
+                 max_connections=100):
+        if httpx is None:
+            raise ImportError("AsyncGitHubAPI requires httpx. "
+                              "Try `pip install httpx`")
+        self.api = api or GitHubAPI(tokens, timeout)
+        self.client = client or httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections))
+        self.logger = self.api.logger
+        self._calls = {}  # key: asyncio.Task, see _coalesce()
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def _call_token(self, token, url, method='get', data=None,
+                          headers=None, **params):
+        """ Async version of APIToken.__call__ """
+        if not token.ready(url):
+            raise TokenNotReady
+        if token.quota_store is not None and not token.quota_store.claim(
+                token_id(token.token), token.api_class(url)):
+            raise TokenNotReady  # exhausted by another process
+
+        if headers:
+            headers = dict(token._headers, **headers)
+        r = await self.client.request(
+            method, token.api_url + url, params=params, content=data,
+            headers=headers or token._headers)
+
+        token._update_limits(r, url)
+        return r
+
+    async def iterate_tokens(self, url=""):
+        """ Async version of VCSAPI.iterate_tokens """
+        while True:
+            token, sleep = self.api.scheduler.pick(url)
+            if token is not None:
+                yield token
+                continue
+
+            sleep = int(sleep) + 1
+            self.logger.info(
+                "%s: out of keys, resuming in %d minutes, %d seconds",
+                datetime.now().strftime("%H:%M"), *divmod(sleep, 60))
+            if self.api.metrics is not None:
+                self.api.metrics.inc('token_wait_seconds', sleep)
+            await asyncio.sleep(sleep)
+            self.logger.info(".. resumed")
+
+    async def _request(self, url, method='get', data=None, **params):
+        """ Async version of VCSAPI._request
+
+        Return:
+            httpx.Response: raw HTTP response
+        """
+        api = self.api
+        cache_key, cached, headers = api._cache_lookup(url, method, params)
+        endpoint = endpoint_class(url)
+        if not api.retry_policy.allow(endpoint):
+            raise CircuitOpen("Requests to %s are suspended after repeated "
+                              "failures" % endpoint)
+
+        attempt, delay = 0, 0
+        throttled = {}  # token: (times throttled, last cooldown)
+        tokens = self.iterate_tokens(url)
+        try:
+            async for token in tokens:
+                started = time.time()
+                try:
+                    r = await self._call_token(
+                        token, url, method=method, data=data,
+                        headers=headers, **params)
+                except TokenNotReady:
+                    continue
+                except httpx.TransportError:
+                    attempt += 1
+                    delay = api._backoff(url, 'connection', attempt, delay)
+                    if delay is None:
+                        raise requests.exceptions.ConnectionError(
+                            "Failed to connect to %s" % url)
+                    await asyncio.sleep(delay)
+                    continue  # i.e. try again
+                api._observe_response(token, url, r, time.time() - started)
+
+                if r.status_code in api.status_not_found:  # API v3 only
+                    raise RepoDoesNotExist(
+                        "%s API returned status %s at %s" % (
+                            api.__class__.__name__, r.status_code, url))
+                elif r.status_code in api.status_internal_error:
+                    attempt += 1
+                    delay = api._backoff(
+                        url, 'server_error', attempt, delay, r)
+                    if delay is None:
+                        raise requests.exceptions.Timeout("VCS is down")
+                    await asyncio.sleep(delay)
+                    continue  # i.e. try again
+                elif r.status_code in api.status_too_many_requests and \
+                        api._throttled(r):
+                    count, cooldown = throttled.get(token, (0, 0))
+                    cooldown = api._backoff(
+                        url, 'too_many_requests', count + 1, cooldown, r)
+                    if cooldown is None:
+                        raise requests.exceptions.Timeout(
+                            "Too many requests from the same IP. "
+                            "Are you abusing the API?")
+                    throttled[token] = (count + 1, cooldown)
+                    token.cool_down(cooldown)  # retry with another token
+                    continue
+
+                api.retry_policy.success(endpoint)
+                if r.status_code >= 400:
+                    raise VCSError("%s Error at %s" % (r.status_code, url),
+                                   response=r)
+                return api._cache_response(r, cache_key, cached)
+        finally:
+            # don't leave the generator to be finalized by the event loop
+            await tokens.aclose()
+
+    async def request(self, url, method='get', data=None, paginate=False,
+                      fields=None, **params):
+        """ Async version of VCSAPI.request """
+        api = self.api
+        extract = projection(fields)
+        if not paginate:
+            if method == 'get' and api.dedup is not None:
+                # same key as in VCSAPI.request, so results are shared
+                key = url + '?' + repr(sorted(params.items()))
+                results = await self._coalesce(
+                    api.dedup, key,
+                    lambda: self._fetch(url, method, data, params))
+            else:
+                results = await self._fetch(url, method, data, params)
+            for res in results:  # zero or one object
+                yield res if extract is None or not res else extract(res)
+            return
+
+        params.update(api.init_pagination())
+        while True:
+            r = await self._request(url, method, data, **params)
+            if r.status_code in api.status_empty:
+                return
+
+            res = api._extract(r, url)
+            for item in res:
+                yield item if extract is None else extract(item)
+            if not res or not api._has_next_page(r):
+                return
+            params["page"] += 1
+
+    async def _fetch(self, url, method, data, params):
+        """ Get the result of a non-paginated request
+        Returns:
+            tuple: zero or one parsed object
+        """
+        r = await self._request(url, method, data, **params)
+        if r.status_code in self.api.status_empty:
+            return ()
+        return (self.api._extract(r, url),)
+
+    async def _coalesce(self, cache, key, func):
+        """ Async version of LRUCache.get_or_call()
+
+        Concurrent calls for the same key await a single computation instead
+        of blocking the event loop. Exceptions are not cached.
+
+        Args:
+            cache (LRUCache): cache of results
+            key (Hashable): cache key
+            func (callable): coroutine function computing the result
+        """
+        res = cache.get(key, _MISSING)
+        if res is not _MISSING:
+            return res
+        task = self._calls.get(key)
+        if task is None:
+            task = self._calls[key] = asyncio.ensure_future(
+                self._compute(cache, key, func))
+        # cancelling one of the callers doesn't cancel the others
+        return await asyncio.shield(task)
+
+    async def _compute(self, cache, key, func):
+        try:
+            res = await func()
+            cache.set(key, res)
+            return res
+        finally:
+            del self._calls[key]
+
+    async def _memoized(self, name, args, url, params, fields):
+        """ Async version of @memoize """
+        extract = projection(fields)
+
+        async def call():
+            try:
+                return await self._single(url, params)
+            except RepoDoesNotExist as e:
+                return _NotFound(e.args)
+
+        res = await self._coalesce(self.api.memo, (name,) + args, call)
+        if isinstance(res, _NotFound):
+            raise RepoDoesNotExist(*res.args)
+        return res if extract is None or not res else extract(res)
+
+    async def v4(self, query, object_path=None, **params):
+        """ Async version of GitHubAPIv4.v4 """
+        if object_path is None:
+            object_path = parse_graphql_path(query) or ()
+
+        while True:
+            payload = json.dumps({'query': query, 'variables': params})
+
+            r = await self._request('graphql', 'post', data=payload)
+            if r.status_code in self.api.status_empty:
+                return
+
+            res = self.api._extract(r, 'graphql')
+            nodes, page_info = GitHubAPIv4._parse_v4(res, object_path)
+            if page_info is None:
+                yield nodes
+                return
+
+            for obj in nodes:
+                yield obj
+            if not json_path(page_info, ('hasNextPage',)):
+                break
+            params['cursor'] = json_path(page_info, ('endCursor',))
+
+    async def _single(self, url, params):
+        gen = self.request(url, **params)
+        try:
+            return await gen.__anext__()
+        finally:
+            await gen.aclose()
+
+    async def _paginate(self, url, params, filter_func=None):
+        extract = None
+        if filter_func is not None:
+            # filters need full records, so project them afterwards
+            extract = projection(params.pop('fields', None))
+        async for item in self.request(url, paginate=True, **params):
+            if filter_func is None or filter_func(item):
+                yield item if extract is None else extract(item)
+
+    def __getattr__(self, name):
+        # only called for missing attributes; `api` is missing in __init__
+        method = name != 'api' and getattr(type(self.api), name, None)
+        spec = getattr(method, 'api_spec', None)
+        if spec is None:
+            raise AttributeError(
+                "'%s' object has no attribute '%s'" % (
+                    self.__class__.__name__, name))
+        url, paginate, params, func = spec
+        filter_func = getattr(method, 'api_filter', None)
+
+        def caller(*args, **kwargs):
+            formatted_url = url % func(self.api, *args)
+            # pages are not blocking the event loop, so there is no need to
+            # prefetch them or to fetch them in threads
+            for option in ('prefetch', 'concurrency', 'ordered'):
+                kwargs.pop(option, None)
+            if getattr(method, 'memoized', False) and \
+                    self.api.memo is not None and not set(kwargs) - {'fields'}:
+                return self._memoized(name, args, formatted_url, dict(params),
+                                      kwargs.get('fields'))
+            request_params = dict(params, **kwargs)
+            if paginate:
+                return self._paginate(
+                    formatted_url, request_params, filter_func)
+            return self._single(formatted_url, request_params)
+
+        caller.__name__ = name
+        caller.__doc__ = method.__doc__
+        return caller
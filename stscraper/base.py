@@ -3,15 +3,27 @@ from __future__ import absolute_import
 
 import requests
 
+import collections
 from datetime import datetime
+import heapq
+import importlib
+import itertools
+import json
 import logging
-import random
+import operator
 import re
+from six.moves import queue
 import six
+import threading
 import time
+import types
 from typing import Iterable, Iterator, Optional, Tuple, Union
 from functools import wraps
 
+from .metrics import endpoint_class
+from .quota import token_id
+from .retry import RetryPolicy
+
 
 class VCSError(requests.HTTPError):
     pass
@@ -25,6 +37,11 @@ class TokenNotReady(VCSError):
     pass
 
 
+class CircuitOpen(VCSError):
+    """ Requests to this endpoint are suspended after repeated failures """
+    pass
+
+
 """
 >>> URL_PATTERN.search("github.com/jaraco/jaraco.xkcd").group(0)
 'github.com/jaraco/jaraco.xkcd'
@@ -40,6 +57,45 @@ PATTERN = r"\b(?:" \
 URL_PATTERN = re.compile(PATTERN)
 
 
+_json_decoders = None
+
+
+def json_decoders():
+    # type: () -> collections.OrderedDict
+    """ Get available JSON parsers taking raw response body, by name,
+    in the order of preference. Optional parsers are only imported on the
+    first call, to keep `import stscraper` fast """
+    global _json_decoders
+    if _json_decoders is None:
+        decoders = collections.OrderedDict()
+        for name in ('orjson', 'simdjson'):
+            try:
+                decoders[name] = importlib.import_module(name).loads
+            except ImportError:  # optional dependency
+                pass
+        decoders['json'] = json.loads
+        _json_decoders = decoders
+    return _json_decoders
+
+
+def get_json_decoder(name=None):
+    """ Get a function parsing JSON from bytes
+
+    Args:
+        name (Optional[str]): one of `json_decoders()`: 'orjson', 'simdjson'
+            or 'json' (standard library). By default, the fastest available
+            one is used.
+    """
+    decoders = json_decoders()
+    if name is None:
+        return next(iter(decoders.values()))
+    try:
+        return decoders[name]
+    except KeyError:
+        raise ValueError("JSON decoder %s is not available. Available: %s" % (
+            name, ", ".join(decoders)))
+
+
 def named_url_pattern(name):
     """ Return project-specific pattern
     This pattern must be consistent with URL_PATTERN
@@ -114,31 +170,208 @@ def json_map(mapping, obj):
             for key, path in mapping.items()}
 
 
+def _compile_path(path):
+    """ Make a getter function equivalent to json_path(obj, path) """
+    getters = []
+    join_key = None
+    for chunk in path:
+        if chunk.startswith(","):
+            # supported only for the last chunk in the path, see json_path
+            join_key = chunk[1:]
+            break
+        getters.append(operator.itemgetter(chunk))
+
+    if len(getters) == 1 and join_key is None:
+        getter = getters[0]
+
+        def get(obj):
+            try:
+                return getter(obj)
+            except (KeyError, TypeError):
+                return None
+        return get
+
+    def get(obj):
+        try:
+            for getter in getters:
+                obj = getter(obj)
+            if join_key is not None:
+                obj = ",".join(str(item.get(join_key)) for item in obj)
+        except (KeyError, TypeError):
+            return None
+        return obj
+    return get
+
+
+class CompiledMapping(object):
+    """ Reusable extractor produced by compile_mapping() """
+    __slots__ = ('keys', 'getters')
+
+    def __init__(self, mapping):
+        # type: (dict) -> None
+        self.keys = tuple(mapping)
+        self.getters = tuple(_compile_path(mapping[key].split("__"))
+                             for key in self.keys)
+
+    def __call__(self, obj):
+        # type: (dict) -> dict
+        return {key: get(obj) for key, get in zip(self.keys, self.getters)}
+
+    def columns(self, objs):
+        # type: (Iterable[dict]) -> dict
+        """ Extract values of multiple objects as columns, in one pass """
+        columns = tuple([] for _ in self.keys)
+        pairs = tuple(zip([column.append for column in columns], self.getters))
+        for obj in objs:
+            for append, get in pairs:
+                append(get(obj))
+        return dict(zip(self.keys, columns))
+
+
+def compile_mapping(mapping):
+    # type: (dict) -> CompiledMapping
+    """ Prepare a json_map() mapping for repeated use.
+
+    Paths are parsed only once, so it is much faster than json_map() on
+    large number of objects.
+
+    >>> extract = compile_mapping({"author_login": "author__name",
+    ...                            'foo': 'bar'})
+    >>> extract({'author': {'name': 'John'}, 'committer': None})
+    {'author_login': 'John', 'foo': None}
+    >>> extract.columns([{'author': {'name': 'John'}}, {'author': None}])
+    {'author_login': ['John', None], 'foo': [None, None]}
+    """
+    return CompiledMapping(mapping)
+
+
+def projection(fields):
+    # type: (Optional[Union[dict, callable]]) -> Optional[callable]
+    """ Normalize `fields` request option: a json_map() mapping is
+    compiled, callables are used as is """
+    if fields is None or callable(fields):
+        return fields
+    return compile_mapping(fields)
+
+
 # syntax sugar for GET API calls
 def api(url, paginate=False, **params):
+    if 'fields' in params:  # default projection, compile once
+        params['fields'] = projection(params['fields'])
+
     def wrapper(func):
         @wraps(func)
-        def caller(self, *args):
+        def caller(self, *args, **kwargs):
+            # kwargs are extra request options, e.g. query params or prefetch
             formatted_url = url % func(self, *args)
+            request_params = dict(params, **kwargs)
             if paginate:
-                return self.request(formatted_url, paginate=True, **params)
+                return self.request(
+                    formatted_url, paginate=True, **request_params)
             else:
-                return next(self.request(formatted_url, **params))
+                return next(self.request(formatted_url, **request_params))
+        # keep the endpoint spec for alternative engines (see stscraper.aio)
+        caller.api_spec = (url, paginate, params, func)
         return caller
     return wrapper
 
 
+class _NotFound(object):
+    """ RepoDoesNotExist cached by @memoize """
+    __slots__ = ('args',)
+
+    def __init__(self, args):
+        self.args = args
+
+
+def memoize(func):
+    """ Cache results of an API method in `self.memo`, if it is set.
+    Calls with request options other than `fields` are not cached.
+    Missing objects are cached as well, so RepoDoesNotExist is raised again
+    without a request until the memo entry expires.
+    """
+    @wraps(func)
+    def caller(self, *args, **kwargs):
+        memo = self.memo
+        if memo is None or set(kwargs) - {'fields'}:
+            return func(self, *args, **kwargs)
+        extract = projection(kwargs.get('fields'))
+
+        def call():
+            try:
+                return func(self, *args)
+            except RepoDoesNotExist as e:
+                return _NotFound(e.args)
+
+        res = memo.get_or_call((func.__name__,) + args, call)
+        if isinstance(res, _NotFound):
+            raise RepoDoesNotExist(*res.args)
+        return res if extract is None or not res else extract(res)
+    # results are shared with alternative engines (see stscraper.aio)
+    caller.memoized = True
+    return caller
+
+
 def api_filter(filter_func):
     def wrapper(func):
         @wraps(func)
-        def caller(*args):
-            for item in func(*args):
+        def caller(*args, **kwargs):
+            # filters need full records, so project them afterwards
+            extract = projection(kwargs.pop('fields', None))
+            for item in func(*args, **kwargs):
                 if filter_func(item):
-                    yield item
+                    yield item if extract is None else extract(item)
+        caller.api_filter = filter_func
         return caller
     return wrapper
 
 
+def read_ahead(iterable, depth=1):
+    """ Iterate in a background thread, keeping up to `depth` items ready
+
+    It is used to fetch next pages of paginated responses while the consumer
+    is processing the current one. Exceptions are re-raised in the consumer
+    thread. If the consumer stops early, the background thread stops after
+    the item it is working on.
+    """
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    item_flag, error_flag, stop_flag = range(3)
+
+    def put(flag, item):
+        while not stop.is_set():
+            try:
+                items.put((flag, item), timeout=0.1)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    def worker():
+        try:
+            for item in iterable:
+                if not put(item_flag, item):
+                    return
+        except Exception as e:
+            put(error_flag, e)
+        else:
+            put(stop_flag, None)
+
+    thread = threading.Thread(target=worker)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            flag, item = items.get()
+            if flag == stop_flag:
+                return
+            elif flag == error_flag:
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
 class APIToken(object):
     """ An abstract container for an API token
     """
@@ -152,9 +385,19 @@ class APIToken(object):
     _headers = {}  # type: dict
     # supported API classes (e.g. core, search etc)
     api_classes = ('core',)  # type: Tuple
-    # rate limits for API classes
+    # rate limits for API classes.
+    # Values are replaced, not updated, so that readers always see
+    # a consistent dictionary. Replace them while holding `_lock`
     limits = None  # type: dict
-    session = None  # type: requests.Session
+    # limits shared with other processes, see stscraper.quota
+    quota_store = None
+    # unix time until which the token is throttled by the API,
+    # e.g. by GitHub secondary rate limits. Respected by when()
+    cooldown_until = 0
+    # factory of HTTP sessions, see _checkout()
+    session_class = requests.Session
+    # min seconds between reads of shared limits, see _sync_limits()
+    sync_interval = 1
 
     def __init__(self, token=None, timeout=None):
         self.token = token
@@ -164,7 +407,36 @@ class APIToken(object):
             'remaining': None,
             'reset_time': None
         } for api_class in self.api_classes}
-        self.session = requests.Session()
+        self._lock = threading.Lock()
+        # idle HTTP sessions. requests.Session is not thread-safe, so every
+        # request checks out a session for exclusive use. Unlike sessions
+        # per thread, pooled ones keep their connections alive across
+        # short-lived threads, e.g. of read_ahead() and bulk()
+        self._sessions = []
+        self._synced = {}  # api_class: time of the last _sync_limits()
+
+    def _checkout(self):
+        # type: () -> requests.Session
+        """ Take an idle HTTP session, or create a new one """
+        with self._lock:
+            if self._sessions:
+                return self._sessions.pop()
+        return self.session_class()
+
+    def _checkin(self, session):
+        # type: (requests.Session) -> None
+        """ Return a session taken by _checkout() to the pool """
+        with self._lock:
+            self._sessions.append(session)
+
+    def close(self):
+        """ Close idle HTTP sessions and their connections """
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            close = getattr(session, 'close', None)
+            if close is not None:
+                close()
 
     @property
     def is_valid(self):
@@ -178,6 +450,37 @@ class APIToken(object):
     def _update_limits(self, response, url):
         raise NotImplementedError
 
+    def _set_limits(self, api_class, limits):
+        """ Replace limits of an API class and share them, if possible """
+        with self._lock:
+            self.limits[api_class] = limits
+        if self.quota_store is not None \
+                and limits.get('remaining') is not None:
+            self.quota_store.update(token_id(self.token), api_class, limits)
+
+    def _sync_limits(self, api_class, force=False):
+        """ Get the latest limits, possibly updated by other processes.
+        The quota store is read at most once in `sync_interval` seconds,
+        unless `force` is set """
+        if self.quota_store is None:
+            return
+        now = time.time()
+        with self._lock:
+            if not force and \
+                    now - self._synced.get(api_class, 0) < self.sync_interval:
+                return
+            self._synced[api_class] = now
+        limits = self.quota_store.get(token_id(self.token), api_class)
+        if limits is not None:
+            with self._lock:
+                self.limits[api_class] = limits
+
+    def cool_down(self, seconds):
+        """ Don't use this token for the next `seconds` seconds """
+        until = time.time() + seconds
+        with self._lock:
+            self.cooldown_until = max(self.cooldown_until, until)
+
     def check_limits(self):
         """ Get information about remaining limits on the token.
 
@@ -215,16 +518,25 @@ class APIToken(object):
         t = self.when(url)
         return not t or t <= time.time()
 
-    def __call__(self, url, method='get', data=None, **params):
-        """ Make an API request """
-        # TODO: use coroutines, perhaps Tornado (as PY2/3 compatible)
-
+    def __call__(self, url, method='get', data=None, headers=None, **params):
+        """ Make an API request
+        For non-blocking requests, see stscraper.aio
+        """
         if not self.ready(url):
             raise TokenNotReady
-
-        r = self.session.request(
-            method, self.api_url + url, params=params, data=data,
-            headers=self._headers,  timeout=self.timeout)
+        if self.quota_store is not None and not self.quota_store.claim(
+                token_id(self.token), self.api_class(url)):
+            raise TokenNotReady  # exhausted by another process
+
+        if headers:
+            headers = dict(self._headers, **headers)
+        session = self._checkout()
+        try:
+            r = session.request(
+                method, self.api_url + url, params=params, data=data,
+                headers=headers or self._headers,  timeout=self.timeout)
+        finally:
+            self._checkin(session)
 
         self._update_limits(r, url)
 
@@ -255,40 +567,232 @@ class DummyAPIToken(APIToken):
         pass
 
 
+class TokenScheduler(object):
+    """ Pick tokens with the most remaining quota first
+
+    Tokens are kept in a priority queue per API class (e.g. GitHub core and
+    search limits are separate), so picking a token takes O(log n).
+    Requests issued but not yet reflected in token limits are accounted for,
+    so consecutive picks are spread across tokens with similar quota rather
+    than hammering the same token, which triggers GitHub secondary limits.
+    If no token is ready, it reports how long to wait for the earliest reset.
+
+    This class is thread-safe.
+    """
+    def __init__(self, tokens=()):
+        # type: (Iterable[APIToken]) -> None
+        self.tokens = tuple(tokens)
+        self._lock = threading.Lock()
+        self._heaps = {}  # api_class: heap of (key, seq, token)
+        # api_class: heap of (ready time, seq, token) of tokens not ready
+        self._waiting = {}
+        # (token, api_class): [last seen remaining, requests issued since]
+        self._issued = {}
+        self._seq = itertools.count()
+
+    def _key(self, token, url, api_class, now):
+        when = token.when(url) or 0
+        if when > now:
+            return when, 0
+        limits = token.limits.get(api_class) or {}
+        remaining = limits.get('remaining')
+        if remaining is None or (remaining == 0 and when):
+            # never used or the limit was reset since the last request
+            remaining = limits.get('limit') or float('inf')
+        issued = self._issued.get((token, api_class))
+        if issued is not None and issued[0] == remaining:
+            remaining -= issued[1]
+        return 0, -remaining
+
+    def _issue(self, token, api_class):
+        remaining = (token.limits.get(api_class) or {}).get('remaining')
+        issued = self._issued.get((token, api_class))
+        if issued is None or issued[0] != remaining:
+            issued = self._issued[(token, api_class)] = [remaining, 0]
+        issued[1] += 1
+
+    def _push(self, heap, waiting, key, token, now):
+        if key[0] > now:
+            heapq.heappush(waiting, (key[0], next(self._seq), token))
+        else:
+            heapq.heappush(heap, (key, next(self._seq), token))
+
+    def pick(self, url=""):
+        # type: (str) -> Tuple[Optional[APIToken], float]
+        """ Pick the best token to request the specified URL
+
+        Returns:
+            Tuple[Optional[APIToken], float]: a ready token and 0, or None
+                and number of seconds until some token will become ready
+        """
+        if not self.tokens:
+            raise ValueError("No API tokens available")
+        api_class = self.tokens[0].api_class(url)
+        # shared limits take I/O to read, so not under the lock
+        for token in self.tokens:
+            token._sync_limits(api_class)
+        now = time.time()
+        with self._lock:
+            heap = self._heaps.get(api_class)
+            if heap is None:
+                heap = self._heaps[api_class] = []
+                waiting = self._waiting[api_class] = []
+                for token in self.tokens:
+                    self._push(heap, waiting, self._key(
+                        token, url, api_class, now), token, now)
+            waiting = self._waiting[api_class]
+
+            # tokens which became ready since, e.g. after limit reset
+            while waiting and waiting[0][0] <= now:
+                _, _, token = heapq.heappop(waiting)
+                self._push(heap, waiting, self._key(
+                    token, url, api_class, now), token, now)
+
+            while heap:
+                key, _, token = heap[0]
+                fresh_key = self._key(token, url, api_class, now)
+                if fresh_key == key:
+                    break
+                # token limits were updated since it was put in the queue
+                heapq.heappop(heap)
+                self._push(heap, waiting, fresh_key, token, now)
+
+            if not heap:
+                return None, waiting[0][0] - now
+
+            self._issue(token, api_class)
+            heapq.heappop(heap)
+            self._push(heap, waiting, self._key(token, url, api_class, now),
+                       token, now)
+            return token, 0
+
+
 class VCSAPI(object):
+    """ Base class for API pools
+
+    API classes are singletons: all instances of the same class share one
+    token pool, and tokens passed to subsequent instantiations are added to
+    it. Instances are thread-safe, i.e. the same object can be used by
+    multiple threads to make requests concurrently: tokens are assigned by
+    a thread-safe scheduler, limits are updated atomically and every request
+    uses an HTTP session from a per-token pool.
+    """
     _instance = None  # instance of API() for Singleton pattern implementation
+    _instance_lock = threading.RLock()
 
     tokens = ()  # type: Tuple[APIToken]
     token_class = DummyAPIToken  # type: type
+    # persistent response cache, see stscraper.cache
+    cache = None
+    # in-memory cache of recent results, see stscraper.cache.LRUCache
+    dedup = None
+    # cache of @memoize methods, see stscraper.cache.CompactLRUCache
+    memo = None
+    # limits shared with other processes, see stscraper.quota
+    quota_store = None
+    # request metrics registry, see stscraper.metrics
+    metrics = None
+    # function parsing response body, see get_json_decoder().
+    # The fastest available one is chosen on first use
+    json_decoder = None
+    # when and how long to wait before retries, see stscraper.retry
+    retry_policy = None  # type: RetryPolicy
 
     status_too_many_requests = ()
     status_not_found = (404, 451)
     status_empty = (409,)
     status_internal_error = (500, 502, 503)
-    retries_on_timeout = 5
+    retries_on_timeout = 5  # default for retry_policy
 
     def __new__(cls, *args, **kwargs):  # Singleton
-        if not isinstance(cls._instance, cls):
-            cls._instance = super(VCSAPI, cls).__new__(cls)
-
-        cls._instance.__init__(*args, **kwargs)
-        return cls._instance
-
-    def __init__(self, tokens=None, timeout=30):
-        # type: (Optional[Union[Iterable,str]], int) -> None
-        old_tokens = {str(token) for token in self.tokens}
-        if tokens:
-            if isinstance(tokens, six.string_types):
-                tokens = tokens.split(",")
-            new_tokens_instances = [self.token_class(t, timeout=timeout)
-                                    for t in set(tokens) - old_tokens]
-            self.tokens += tuple(t for t in new_tokens_instances if t.is_valid)
+        with cls._instance_lock:
+            if not isinstance(cls._instance, cls):
+                cls._instance = super(VCSAPI, cls).__new__(cls)
+
+            cls._instance.__init__(*args, **kwargs)
+            return cls._instance
+
+    def __init__(self, tokens=None, timeout=30, cache=None, quota_store=None,
+                 metrics=None, json_decoder=None, retry_policy=None,
+                 dedup=None, memo=None):
+        """ Add tokens and options to the API pool
+
+        Args:
+            tokens (Optional[Union[Iterable[str], str]]): API tokens, as
+                a list or a comma-separated string
+            timeout (int): HTTP request timeout, seconds
+            cache (Optional[ResponseCache]): cache for conditional requests,
+                see stscraper.cache
+            quota_store (Optional[QuotaStore]): limits shared with other
+                processes, see stscraper.quota
+            metrics (Optional[Metrics]): registry of request metrics, see
+                stscraper.metrics
+            json_decoder (Optional[Union[str, callable]]): name of a decoder
+                in json_decoders(), or a function decoding bytes
+            retry_policy (Optional[RetryPolicy]): when to retry failed
+                requests, see stscraper.retry
+            dedup (Optional[LRUCache]): coalesces identical concurrent GET
+                requests and keeps their results briefly
+            memo (Optional[LRUCache]): cache of @memoize methods,
+                e.g. repo_info()
+        """
+        if cache is not None:
+            self.cache = cache
+        if dedup is not None:
+            self.dedup = dedup
+        if memo is not None:
+            self.memo = memo
+        if retry_policy is not None:
+            self.retry_policy = retry_policy
+        elif self.retry_policy is None:
+            self.retry_policy = RetryPolicy(retries=self.retries_on_timeout)
+        if metrics is not None:
+            self.metrics = metrics
+        if json_decoder is not None:
+            if isinstance(json_decoder, six.string_types):
+                json_decoder = get_json_decoder(json_decoder)
+            self.json_decoder = json_decoder
+        with self._instance_lock:
+            if quota_store is not None:
+                self.quota_store = quota_store
+                for token in self.tokens:
+                    token.quota_store = quota_store
+            old_tokens = {str(token) for token in self.tokens}
+            if tokens:
+                if isinstance(tokens, six.string_types):
+                    tokens = tokens.split(",")
+                new_tokens_instances = [self.token_class(t, timeout=timeout)
+                                        for t in set(tokens) - old_tokens]
+                for token in new_tokens_instances:
+                    token.quota_store = self.quota_store
+                self.tokens += tuple(
+                    t for t, valid in zip(new_tokens_instances,
+                                          self._validate(new_tokens_instances))
+                    if valid)
+            self.scheduler = TokenScheduler(self.tokens)
         self.logger = logging.getLogger('scraper.' + self.__class__.__name__)
 
+    @staticmethod
+    def _validate(tokens):
+        """ Check `is_valid` of multiple tokens concurrently, since it
+        might take a request per token """
+        if len(tokens) < 2:
+            return [token.is_valid for token in tokens]
+        from concurrent import futures
+        with futures.ThreadPoolExecutor(
+                max_workers=min(len(tokens), 16)) as executor:
+            return list(executor.map(lambda token: token.is_valid, tokens))
+
     def _has_next_page(self, response):
         """ Check if there is a next page to a paginated response """
         raise NotImplementedError
 
+    def _last_page(self, response):
+        """ Get the number of the last page of a paginated response, if the
+        API provides this information. Used to fetch pages in parallel.
+        """
+        return None
+
     @staticmethod
     def init_pagination():
         """ Update request params to allow pagination
@@ -296,12 +800,99 @@ class VCSAPI(object):
         """
         return {'page': 1, 'per_page': 100}
 
-    @staticmethod
-    def extract_result(response):
+    def extract_result(self, response):
         """ Parse results from the response.
-        For most APIs, it is just parsing JSON
+        For most APIs, it is just parsing JSON. The raw body is passed to
+        the decoder as is, without decoding it into a string first.
+        """
+        decoder = self.json_decoder
+        if decoder is None:
+            decoder = self.json_decoder = get_json_decoder()
+        return decoder(response.content)
+
+    def _extract(self, response, url):
+        """ extract_result(), timed if metrics are enabled """
+        if self.metrics is None:
+            return self.extract_result(response)
+        started = time.time()
+        res = self.extract_result(response)
+        self.metrics.observe('decode_seconds', time.time() - started,
+                             endpoint=endpoint_class(url))
+        return res
+
+    def _observe_response(self, token, url, response, elapsed):
+        """ Record response metrics, if enabled """
+        if self.metrics is None:
+            return
+        endpoint = endpoint_class(url)
+        self.metrics.observe('request_seconds', elapsed, endpoint=endpoint)
+        self.metrics.inc('responses', endpoint=endpoint,
+                         status=response.status_code)
+        self.metrics.inc('received_bytes', len(response.content),
+                         endpoint=endpoint)
+        self.metrics.inc('token_requests', token=token_id(token.token)[:8])
+
+    def _cache_lookup(self, url, method, params):
+        """ Get the cached response to revalidate, if the response cache is
+        enabled and the request can be cached
+
+        Returns:
+            Tuple[Optional[str], Optional[tuple], Optional[dict]]: cache key,
+                cached body and headers, and conditional request headers
         """
-        return response.json()
+        if self.cache is None or method != 'get':
+            return None, None, None
+        key = self.cache.key(url, params)
+        cached = self.cache.get(key)
+        return key, cached, self.cache.conditional_headers(cached)
+
+    def _cache_response(self, response, key, cached):
+        """ Restore a 304 response from cache, or cache a successful one.
+        `key` and `cached` are returned by _cache_lookup() """
+        if key is None:
+            return response
+        if response.status_code == 304 and cached:
+            return self.cache.restore(response, cached)
+        self.cache.store(key, response)
+        return response
+
+    def _backoff(self, url, reason, attempt, previous=0, response=None):
+        """ Get the delay before retrying a failed request
+
+        Args:
+            url (str): request URL
+            reason (str): 'connection', 'server_error' or 'too_many_requests'
+            attempt (int): number of the retry, starting from 1
+            previous (float): delay before the previous retry
+            response (Optional[requests.Response]): failed response, if any
+        Returns:
+            Optional[float]: seconds to wait, or None to give up
+        """
+        policy = self.retry_policy
+        endpoint = endpoint_class(url)
+        if reason != 'too_many_requests':  # rate limits are not failures
+            policy.failure(endpoint)
+        retry_after = response is not None and policy.retry_after(response)
+        delay = policy.delay(endpoint, attempt, previous, retry_after or None)
+        if delay is not None:
+            # throttled tokens cool down while others are used, no sleep
+            self._observe_retry(
+                url, reason, delay if reason != 'too_many_requests' else 0)
+        return delay
+
+    def _throttled(self, response):
+        """ Check if a `status_too_many_requests` response means the token
+        is throttled, so it is worth retrying the request with another one """
+        return True
+
+    def _observe_retry(self, url, reason, sleep=0):
+        """ Record a retry and the time slept before it, if enabled """
+        if self.metrics is None:
+            return
+        self.metrics.inc('retries', endpoint=endpoint_class(url),
+                         reason=reason)
+        if sleep:
+            self.metrics.inc('backoff_seconds', sleep)
 
     def iterate_tokens(self, url=""):
         """Infinite generator of tokens, taking care of their availability
@@ -313,25 +904,102 @@ class VCSAPI(object):
             (APIToken): a token object
         """
         while True:
-            # problem with iterating them in the same order
-            # (eg, sorted by expiration): in multithreaded case,
-            # all threads are using the same token and GitHub imposes
-            # temporary limits. So, random order
-            for token in random.sample(self.tokens, len(self.tokens)):
-                if not token.ready(url):
-                    continue
+            token, sleep = self.scheduler.pick(url)
+            if token is not None:
                 yield token
+                continue
+
+            sleep = int(sleep) + 1
+            self.logger.info(
+                "%s: out of keys, resuming in %d minutes, %d seconds",
+                datetime.now().strftime("%H:%M"), *divmod(sleep, 60))
+            if self.metrics is not None:
+                self.metrics.inc('token_wait_seconds', sleep)
+            time.sleep(sleep)
+            self.logger.info(".. resumed")
+
+    def remaining_quota(self, url=""):
+        """ Total number of requests available across all ready tokens
+
+        Returns:
+            Optional[int]: number of requests, or None if some tokens have
+                not reported their limits yet
+        """
+        total = 0
+        for token in self.tokens:
+            if not token.ready(url):
+                continue
+            remaining = token.limits.get(
+                token.api_class(url), {}).get('remaining')
+            if remaining is None:
+                return None
+            total += remaining
+        return total
+
+    def bulk(self, method, args, concurrency=8, ordered=False):
+        """ Call an API method for many arguments concurrently
+
+        >>> api = GitHubAPI()
+        >>> for slug, info in api.bulk('repo_info', slugs, concurrency=16):
+        ...     if isinstance(info, Exception):
+        ...         continue
+
+        Args:
+            method (Union[str, callable]): API method or its name,
+                e.g. 'repo_info'
+            args (Iterable): method arguments; tuples are unpacked as
+                multiple positional arguments
+            concurrency (int): max number of calls in flight. It is also
+                capped by the remaining quota of the token pool.
+            ordered (bool): whether to yield results in the order of
+                arguments, rather than as they complete
+
+        Generates:
+            Tuple[object, object]: (argument, result or raised exception).
+                Results of paginated methods are collected into lists.
+        """
+        # thread pools are only needed here; import on first use to keep
+        # `import stscraper` fast for short-lived scripts
+        from concurrent import futures
+
+        if isinstance(method, six.string_types):
+            method = getattr(self, method)
+
+        def call(arg):
+            res = method(*arg) if isinstance(arg, tuple) else method(arg)
+            if isinstance(res, types.GeneratorType):
+                res = list(res)
+            return res
+
+        def result(future):
+            return future.exception() or future.result()
+
+        args = iter(args)
+        pending = collections.deque()  # (arg, future) pairs
+        with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                quota = self.remaining_quota()
+                limit = concurrency if quota is None else \
+                    max(1, min(concurrency, quota))
+                for arg in itertools.islice(args, max(0, limit-len(pending))):
+                    pending.append((arg, executor.submit(call, arg)))
+                if not pending:
+                    return
+
+                if ordered:
+                    arg, future = pending.popleft()
+                    yield arg, result(future)
+                    continue
 
-            next_res = min(token.when(url) for token in self.tokens)
-            sleep = next_res and int(next_res - time.time()) + 1
-            if sleep > 0:
-                self.logger.info(
-                    "%s: out of keys, resuming in %d minutes, %d seconds",
-                    datetime.now().strftime("%H:%M"), *divmod(sleep, 60))
-                time.sleep(sleep)
-                self.logger.info(".. resumed")
+                done, _ = futures.wait([future for _, future in pending],
+                                       return_when=futures.FIRST_COMPLETED)
+                for arg, future in [p for p in pending if p[1] in done]:
+                    pending.remove((arg, future))
+                    yield arg, result(future)
 
-    def request(self, url, method='get', data=None, paginate=False, **params):
+    def request(self, url, method='get', data=None, paginate=False,
+                prefetch=0, concurrency=1, ordered=True, fields=None,
+                **params):
         """ Make an API request, taking care of pagination
 
         Args:
@@ -339,10 +1007,46 @@ class VCSAPI(object):
             method (str): HTTP method type
             data (str): API request payload (for POST requests)
             paginate (bool): flag to take care of pagination
+            prefetch (int): number of pages to fetch in background while the
+                current one is being consumed. This is only used with
+                paginated requests and limits memory use as well.
+            concurrency (int): if the API reports the number of pages, fetch
+                up to this many pages in parallel
+            ordered (bool): with `concurrency`, whether to keep the page
+                order or to yield pages as they arrive
+            fields (Union[dict, callable]): a json_map() mapping or a function
+                to apply to every record as soon as the page is parsed, so
+                that only the projection is kept in memory
 
         Generates:
             object: parsed object, API-specific
         """
+        if not paginate and method == 'get' and self.dedup is not None:
+            # recent and concurrent identical requests share the result
+            key = url + '?' + repr(sorted(params.items()))
+            results = self.dedup.get_or_call(key, lambda: tuple(
+                self._pages(url, method, data, **params)))
+            extract = projection(fields)
+            for res in results:  # zero or one object
+                yield res if extract is None or not res else extract(res)
+            return
+
+        pages = self._pages(url, method, data, paginate, concurrency, ordered,
+                            projection(fields), **params)
+        if not paginate:
+            for res in pages:
+                yield res
+            return
+
+        if prefetch:
+            pages = read_ahead(pages, prefetch)
+        for page in pages:
+            for item in page:
+                yield item
+
+    def _pages(self, url, method='get', data=None, paginate=False,
+               concurrency=1, ordered=True, extract=None, **params):
+        """ Generate parsed result of every page of the response """
         if paginate:
             params.update(self.init_pagination())
 
@@ -351,18 +1055,40 @@ class VCSAPI(object):
             if r.status_code in self.status_empty:
                 return
 
-            res = self.extract_result(r)
-            if paginate:
-                for item in res:
-                    yield item
-                if not res or not self._has_next_page(r):
-                    return
-                else:
-                    params["page"] += 1
-                    continue
-            else:
-                yield res
+            res = self._extract(r, url)
+            if extract is not None and res:
+                res = [extract(item) for item in res] if paginate \
+                    else extract(res)
+            yield res
+            if not paginate or not res or not self._has_next_page(r):
+                return
+
+            last_page = concurrency > 1 and self._last_page(r)
+            if last_page:
+                pages = range(params["page"] + 1, last_page + 1)
+                for res in self._fan_out(url, method, data, pages,
+                                         concurrency, ordered, extract,
+                                         params):
+                    yield res
                 return
+            params["page"] += 1
+
+    def _fan_out(self, url, method, data, pages, concurrency, ordered,
+                 extract, params):
+        """ Fetch multiple pages of the response in parallel """
+        def fetch(page):
+            r = self._request(url, method, data, **dict(params, page=page))
+            if r.status_code in self.status_empty:
+                return []
+            res = self._extract(r, url)
+            if extract is not None:
+                res = [extract(item) for item in res]
+            return res
+
+        for _, res in self.bulk(fetch, pages, concurrency, ordered):
+            if isinstance(res, Exception):
+                raise res
+            yield res
 
     def _request(self, url, method='get', data=None, **params):
         """ Make
@@ -374,10 +1100,19 @@ class VCSAPI(object):
         Return:
             requests.Response: raw HTTP response
         """
-        timeout_counter = 0
+        cache_key, cached, headers = self._cache_lookup(url, method, params)
+        endpoint = endpoint_class(url)
+        if not self.retry_policy.allow(endpoint):
+            raise CircuitOpen("Requests to %s are suspended after repeated "
+                              "failures" % endpoint)
+
+        attempt, delay = 0, 0
+        throttled = {}  # token: (times throttled, last cooldown)
         for token in self.iterate_tokens(url):
+            started = time.time()
             try:
-                r = token(url, method=method, data=data, **params)
+                r = token(url, method=method, data=data, headers=headers,
+                          **params)
             except TokenNotReady:
                 continue
             except requests.exceptions.RequestException:
@@ -385,32 +1120,45 @@ class VCSAPI(object):
                 # a connection once in a while (bad status line).
                 # To account for more general issues like this,
                 # TimeoutException was replaced with RequestException
-                timeout_counter += 1
-                if timeout_counter > self.retries_on_timeout:
+                attempt += 1
+                delay = self._backoff(url, 'connection', attempt, delay)
+                if delay is None:
                     raise
+                time.sleep(delay)
                 continue  # i.e. try again
+            self._observe_response(token, url, r, time.time() - started)
 
             if r.status_code in self.status_not_found:  # API v3 only
                 raise RepoDoesNotExist(
                     "%s API returned status %s at %s" % (
                         self.__class__.__name__, r.status_code, url))
             elif r.status_code in self.status_internal_error:
-                timeout_counter += 1
-                if timeout_counter > self.retries_on_timeout:
+                attempt += 1
+                delay = self._backoff(url, 'server_error', attempt, delay, r)
+                if delay is None:
                     raise requests.exceptions.Timeout("VCS is down")
-                time.sleep(2**timeout_counter)
+                time.sleep(delay)
                 continue  # i.e. try again
-            elif r.status_code in self.status_too_many_requests:
-                timeout_counter += 1
-                if timeout_counter > self.retries_on_timeout:
+            elif r.status_code in self.status_too_many_requests and \
+                    self._throttled(r):
+                # retries are counted per token, so that moving on to
+                # another token doesn't use up the retries
+                count, cooldown = throttled.get(token, (0, 0))
+                cooldown = self._backoff(
+                    url, 'too_many_requests', count + 1, cooldown, r)
+                if cooldown is None:
                     raise requests.exceptions.Timeout(
                         "Too many requests from the same IP. "
                         "Are you abusing the API?")
-                time.sleep(1 << (timeout_counter+1))
+                throttled[token] = (count + 1, cooldown)
+                # only this token is throttled; retry right away with another
+                # one. If all of them are cooling down, iterate_tokens waits
+                token.cool_down(cooldown)
                 continue
 
+            self.retry_policy.success(endpoint)
             r.raise_for_status()
-            return r
+            return self._cache_response(r, cache_key, cached)
 
     def all_users(self):
         # type: () -> Iterable[dict]
@@ -0,0 +1,330 @@
+""" Persistent HTTP response caches.
+
+GitHub doesn't charge rate limit for `304 Not Modified` responses, so
+re-crawling with conditional requests is much cheaper. To use a cache, pass it
+to the API constructor:
+
+>>> from stscraper.cache import SQLiteCache
+>>> api = GitHubAPI(cache=SQLiteCache('~/.cache/stscraper.sqlite'))
+
+Only GET requests are cached.
+
+For repeated requests within a short time, e.g. `user_info()` of every
+commit author, an in-memory LRUCache saves the requests altogether; it also
+makes concurrent identical requests share a single API call:
+
+>>> api = GitHubAPI(dedup=LRUCache(max_entries=10000, ttl=300))
+"""
+
+from __future__ import absolute_import
+
+import collections
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from six.moves.urllib.parse import urlencode
+
+from .base import get_json_decoder
+
+
+class ResponseCache(object):
+    """ An abstract storage for HTTP response bodies and validators.
+    Subclasses only need to implement `get()` and `set()`
+    """
+    # response headers stored along with the body.
+    # Link is required to paginate cached responses
+    headers = ('ETag', 'Last-Modified', 'Link', 'Content-Type')
+
+    @staticmethod
+    def key(url, params):
+        # type: (str, dict) -> str
+        return url + '?' + urlencode(sorted(params.items()))
+
+    def get(self, key):
+        # type: (str) -> Optional[Tuple[bytes, dict]]
+        """ Get cached response body and headers, if any """
+        raise NotImplementedError
+
+    def set(self, key, body, headers):
+        # type: (str, bytes, dict) -> None
+        raise NotImplementedError
+
+    @staticmethod
+    def conditional_headers(cached):
+        """ Request headers to revalidate a cached response """
+        if not cached:
+            return {}
+        headers = {}
+        if cached[1].get('ETag'):
+            headers['If-None-Match'] = cached[1]['ETag']
+        if cached[1].get('Last-Modified'):
+            headers['If-Modified-Since'] = cached[1]['Last-Modified']
+        return headers
+
+    def store(self, key, response):
+        """ Cache a response, if it has validators """
+        headers = {h: response.headers[h]
+                   for h in self.headers if h in response.headers}
+        if 'ETag' in headers or 'Last-Modified' in headers:
+            self.set(key, response.content, headers)
+
+    @staticmethod
+    def restore(response, cached):
+        """ Turn a 304 response into a complete one using cached data """
+        body, headers = cached
+        response.status_code = 200
+        response._content = body
+        response.headers.update(headers)
+        return response
+
+
+class SQLiteCache(ResponseCache):
+    """ Response cache backed by a SQLite database.
+    Safe to use from multiple threads and processes.
+    """
+    def __init__(self, path):
+        path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            if path != ':memory:':
+                self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS responses '
+                '(key TEXT PRIMARY KEY, body BLOB, headers TEXT)')
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT body, headers FROM responses WHERE key = ?',
+                (key,)).fetchone()
+        if row is None:
+            return None
+        return bytes(row[0]), json.loads(row[1])
+
+    def set(self, key, body, headers):
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?)',
+                (key, sqlite3.Binary(body), json.dumps(headers)))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class _Call(object):
+    """ A computation in progress, awaited by concurrent callers """
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class LRUCache(object):
+    """ Thread-safe in-memory LRU cache with expiration.
+
+    `get_or_call()` also makes concurrent callers asking for the same key
+    wait for a single computation ("single flight"). Cached values are shared
+    by all callers, so they shouldn't be modified.
+
+    Args:
+        max_entries (int): max number of cached values
+        ttl (float): seconds to keep values. With 0, values are not cached,
+            but concurrent calls are still coalesced.
+        max_bytes (Optional[int]): approximate max size of cached values.
+            Value sizes, including nested objects, are estimated by
+            `sizeof()`, which takes time proportional to the value size.
+
+    Attributes:
+        hits (int): number of values served from cache
+        misses (int): number of computed values
+        coalesced (int): number of calls which waited for a concurrent
+            computation of the same key
+        evictions (int): number of values removed to free space
+    """
+    def __init__(self, max_entries=10000, ttl=60, max_bytes=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.bytes = 0
+        # key: (expires, stored value, size)
+        self._entries = collections.OrderedDict()
+        self._calls = {}  # key: _Call in progress
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def sizeof(value):
+        # type: (object) -> int
+        """ Estimate memory used by a stored value, including nested
+        containers and strings. Shared objects are counted once """
+        seen = set()
+        size = 0
+        stack = [value]
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            size += sys.getsizeof(obj)
+            if isinstance(obj, dict):
+                stack.extend(obj.keys())
+                stack.extend(obj.values())
+            elif isinstance(obj, (list, tuple, set, frozenset)):
+                stack.extend(obj)
+        return size
+
+    def encode(self, value):
+        """ Convert a value into its stored representation """
+        return value
+
+    def decode(self, stored):
+        """ Restore a value from its stored representation """
+        return stored
+
+    def _get(self, key, now):
+        """ Get a fresh entry and mark it as recently used; hold the lock """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            self.bytes -= entry[2]
+            return None
+        self._entries[key] = entry
+        return entry
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._get(key, time.time())
+            if entry is None:
+                return default
+            self.hits += 1
+        return self.decode(entry[1])
+
+    def _set(self, key, stored):
+        if self.ttl <= 0:
+            return
+        size = self.sizeof(stored) if self.max_bytes is not None else 0
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._entries[key] = (time.time() + self.ttl, stored, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and len(self._entries) > 1
+                    and self.bytes > self.max_bytes):
+                _, entry = self._entries.popitem(last=False)
+                self.bytes -= entry[2]
+                self.evictions += 1
+
+    def set(self, key, value):
+        self._set(key, self.encode(value))
+
+    def get_or_call(self, key, func):
+        """ Get a cached value, or compute it with `func()`.
+        Exceptions are raised to all concurrent callers, but not cached.
+        """
+        with self._lock:
+            entry = self._get(key, time.time())
+            if entry is not None:
+                self.hits += 1
+            else:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self.misses += 1
+                else:
+                    self.coalesced += 1
+        if entry is not None:
+            return self.decode(entry[1])
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return self.decode(call.result)
+
+        try:
+            call.result = self.encode(func())
+        except BaseException as e:
+            call.error = e
+            raise
+        else:
+            self._set(key, call.result)
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return self.decode(call.result)
+
+    def stats(self):
+        # type: () -> dict
+        """ Hit and miss counters, e.g. to tune size and TTL """
+        calls = self.hits + self.misses + self.coalesced
+        return {'entries': len(self), 'bytes': self.bytes,
+                'hits': self.hits, 'misses': self.misses,
+                'coalesced': self.coalesced, 'evictions': self.evictions,
+                'hit_rate': (self.hits + self.coalesced) / float(calls)
+                if calls else 0.0}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+
+class _JSONValue(object):
+    """ A dictionary serialized by CompactLRUCache """
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+
+class CompactLRUCache(LRUCache):
+    """ LRU cache keeping dictionaries serialized as JSON.
+
+    Serialized API objects take several times less memory than dictionaries,
+    at the cost of parsing them on every hit. Every caller gets its own copy
+    of a dictionary, so unlike LRUCache, they can be modified safely.
+    Other values, e.g. tuples of strings, are stored as is.
+
+    >>> api = GitHubAPI(memo=CompactLRUCache(
+    ...     max_entries=100000, max_bytes=256 * 2**20, ttl=3600))
+    """
+    def __init__(self, max_entries=10000, ttl=60, max_bytes=None,
+                 json_decoder=None):
+        super(CompactLRUCache, self).__init__(max_entries, ttl, max_bytes)
+        self.json_decoder = json_decoder or get_json_decoder()
+
+    @staticmethod
+    def sizeof(value):
+        if isinstance(value, _JSONValue):
+            return sys.getsizeof(value) + sys.getsizeof(value.data)
+        return LRUCache.sizeof(value)
+
+    def encode(self, value):
+        if isinstance(value, dict):
+            return _JSONValue(json.dumps(value, separators=(',', ':')).encode(
+                'utf8'))
+        return value
+
+    def decode(self, stored):
+        if isinstance(stored, _JSONValue):
+            return self.json_decoder(stored.data)
+        return stored
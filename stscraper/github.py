@@ -3,12 +3,16 @@ from __future__ import absolute_import
 from __future__ import print_function
 
 import datetime
+import itertools
 import json
 import os
+import re
+import time
 import warnings
 
+from six.moves.urllib.parse import parse_qs, urlparse
+
 from .base import *
-import stutils
 
 # This is a list of preview features
 # https://developer.github.com/v3/previews/
@@ -30,6 +34,8 @@ class GitHubAPIToken(APIToken):
     api_classes = ('core', 'search')
 
     _user = None  # cache user
+    # seconds to trust the token owner remembered by the quota store
+    user_ttl = 24 * 3600
     # dictionaries are mutable. Don't put default headers dict here
     # or it will be shared by all class instances
     _headers = None
@@ -46,6 +52,9 @@ class GitHubAPIToken(APIToken):
 
     @property
     def user(self):
+        if self._user is None and self.quota_store is not None:
+            self._user = self.quota_store.get_user(
+                token_id(self.token), self.user_ttl)
         if self._user is None:
             try:
                 r = self('user')
@@ -53,6 +62,9 @@ class GitHubAPIToken(APIToken):
                 pass
             else:
                 self._user = r.json().get('login', '')
+                if self._user and self.quota_store is not None:
+                    self.quota_store.set_user(
+                        token_id(self.token), self._user)
         return self._user
 
     @property
@@ -68,11 +80,11 @@ class GitHubAPIToken(APIToken):
             stats = {}
 
         for cls in self.api_classes:
-            self.limits[cls] = json_map({
+            self._set_limits(cls, json_map({
                 'remaining': 'remaining',
                 'reset': 'reset',
                 'limit': 'limit',
-            }, stats.get(cls, {}))
+            }, stats.get(cls, {})))
 
         return self.limits
 
@@ -87,19 +99,23 @@ class GitHubAPIToken(APIToken):
         return self.limits['core']['limit'] < 100
 
     def when(self, url):
+        if self.cooldown_until > time.time():
+            return self.cooldown_until
         key = self.api_class(url)
-        if self.limits[key]['remaining'] != 0:
+        limits = self.limits[key]
+        if limits['remaining'] != 0:
             return 0
-        return self.limits[key]['reset']
+        return limits['reset']
 
     def _update_limits(self, response, url):
         if 'X-RateLimit-Remaining' in response.headers:
             remaining = int(response.headers['X-RateLimit-Remaining'])
-            self.limits[self.api_class(url)] = {
+            limits = {
                 'remaining': remaining,
                 'reset': int(response.headers['X-RateLimit-Reset']),
                 'limit': int(response.headers['X-RateLimit-Limit'])
             }
+            self._set_limits(self.api_class(url), limits)
 
             if response.status_code == 403 and remaining == 0:
                 raise TokenNotReady
@@ -112,9 +128,13 @@ class GitHubAPI(VCSAPI):
     """
     token_class = GitHubAPIToken
     base_url = 'https://github.com'
-    status_too_many_requests = (403,)
+    status_too_many_requests = (403, 429)
+    # 403 responses also mean missing permissions, e.g. SAML enforcement
+    _secondary_limit = re.compile(r'secondary rate limit|abuse', re.I)
 
-    def __init__(self, tokens=None, timeout=30):
+    def __init__(self, tokens=None, timeout=30, **kwargs):
+        # stutils is only needed here, to read config
+        import stutils
         # Where to look for tokens:
         # strudel config variables
         if not tokens:
@@ -138,7 +158,14 @@ class GitHubAPI(VCSAPI):
             warnings.warn("No tokens provided. GitHub API will be limited to "
                           "60 requests an hour", Warning)
 
-        super(GitHubAPI, self).__init__(tokens, timeout)
+        # limits shared by all crawlers on this host
+        if kwargs.get('quota_store') is None and self.quota_store is None:
+            quota_store_path = stutils.get_config('GITHUB_API_QUOTA_STORE')
+            if quota_store_path:
+                from .quota import SQLiteQuotaStore
+                kwargs['quota_store'] = SQLiteQuotaStore(quota_store_path)
+
+        super(GitHubAPI, self).__init__(tokens, timeout, **kwargs)
 
     def _has_next_page(self, response):
         for rel in response.headers.get("Link", "").split(","):
@@ -146,6 +173,25 @@ class GitHubAPI(VCSAPI):
                 return True
         return False
 
+    def _last_page(self, response):
+        for rel in response.headers.get("Link", "").split(","):
+            link, _, rel = rel.rpartition(";")
+            if rel.strip() == 'rel="last"':
+                query = urlparse(link.strip(' <>')).query
+                page = parse_qs(query).get('page')
+                return page and int(page[0])
+        return None
+
+    def _throttled(self, response):
+        # https://docs.github.com/en/rest/overview/resources-in-the-rest-api#secondary-rate-limits
+        if response.status_code == 429 or 'Retry-After' in response.headers:
+            return True
+        try:
+            message = response.json().get('message') or ''
+        except (ValueError, AttributeError):
+            return False
+        return bool(self._secondary_limit.search(message))
+
     # ===================================
     #           API methods
     # ===================================
@@ -161,6 +207,7 @@ class GitHubAPI(VCSAPI):
         # https://developer.github.com/v3/repos/#list-all-public-repositories
         return ()
 
+    @memoize
     @api('repos/%s')
     def repo_info(self, repo_slug):
         """Get repository info"""
@@ -203,6 +250,12 @@ class GitHubAPI(VCSAPI):
         # https://docs.github.com/en/free-pro-team@latest/rest/reference/repos#get-a-commit
         return repo_slug, commit_hash
 
+    @api('repos/%s/stargazers', paginate=True)
+    def repo_stargazers(self, repo_slug):
+        """Get users who starred the repository."""
+        # https://docs.github.com/en/rest/activity/starring#list-stargazers
+        return repo_slug
+
     @api('repos/%s/pulls', paginate=True, state='all')
     def repo_pulls(self, repo_slug):
         """Get all repository pull requests.
@@ -211,6 +264,7 @@ class GitHubAPI(VCSAPI):
         # https://developer.github.com/v3/pulls/#list-pull-requests
         return repo_slug
 
+    @memoize
     def repo_topics(self, repo_slug):
         """Get a tuple of repository topics.
         Topics are "keywords" assigned by repository owner.
@@ -221,6 +275,7 @@ class GitHubAPI(VCSAPI):
         return tuple(
             next(self.request('repos/%s/topics' % repo_slug)).get('names'))
 
+    @memoize
     def repo_labels(self, repo_slug):
         """Get a tuple of repository labels.
         Labels are issue tags used by maintainers
@@ -279,6 +334,7 @@ class GitHubAPI(VCSAPI):
         # https://developer.github.com/v3/pulls/comments/
         return repo, pr_id
 
+    @memoize
     @api('users/%s')
     def user_info(self, username):
         """Get user info - name, location, blog etc."""
@@ -403,7 +459,40 @@ class GitHubAPIv4(GitHubAPI):
 
     """
 
-    def v4(self, query, object_path=None, **params):
+    @staticmethod
+    def _parse_v4(res, object_path):
+        """ Extract objects from a parsed v4 response
+
+        Returns:
+            Tuple[object, Optional[dict]]: a list of nodes and pagination
+                info, or the object itself and None if the response is not
+                paginated
+        """
+        if 'errors' in res or 'data' not in res:
+            raise VCSError('API didn\'t return any data:\n' +
+                           json.dumps(res, indent=4))
+        data = res['data']
+
+        try:
+            objects = json_path(data, object_path, raise_on_missing=True)
+        except IndexError:
+            raise VCSError('Invalid object path "%s" in:\n %s' %
+                           (object_path, json.dumps(data)))
+
+        page_info = json_path(objects, ('pageInfo',))
+        if page_info is None:
+            return objects, None
+        # This is due to inconsistency in graphql API.
+        # In most cases, requests returning lists of objects put them in
+        # 'nodes', but in few legacy methods they use 'edges'
+        nodes = objects.get('nodes', objects.get('edges'))
+        if nodes is None:
+            raise EnvironmentError(
+                'Unexpected result format. Please report an issue:\n'
+                'https://github.com/CMUSTRUDEL/strudel.scraper/issues/new')
+        return nodes, page_info
+
+    def v4(self, query, object_path=None, prefetch=0, **params):
         """ Make an API v4 request, taking care of pagination
 
         Args:
@@ -413,6 +502,8 @@ class GitHubAPIv4(GitHubAPI):
                 leading "data" part, and the trailing "nodes" when applicable.
                 If omitted, will return full "data" content
                 Example: ("repository", "issues")
+            prefetch (int): number of pages to fetch in background while the
+                current one is being consumed
             **params: dictionary of query variables.
 
         Yields:
@@ -450,6 +541,18 @@ class GitHubAPIv4(GitHubAPI):
         if object_path is None:
             object_path = parse_graphql_path(query) or ()
 
+        pages = self._v4_pages(query, object_path, **params)
+        if prefetch:
+            pages = read_ahead(pages, prefetch)
+        for nodes, page_info in pages:
+            if page_info is None:
+                yield nodes
+                return
+            for obj in nodes:
+                yield obj
+
+    def _v4_pages(self, query, object_path, **params):
+        """ Generate (nodes, page_info) for every page of the response """
         while True:
             payload = json.dumps({'query': query, 'variables': params})
 
@@ -457,36 +560,13 @@ class GitHubAPIv4(GitHubAPI):
             if r.status_code in self.status_empty:
                 return
 
-            res = self.extract_result(r)
-            if 'errors' in res or 'data' not in res:
-                raise VCSError('API didn\'t return any data:\n' +
-                               json.dumps(res, indent=4))
-            data = res['data']
-
-            try:
-                objects = json_path(data, object_path, raise_on_missing=True)
-            except IndexError:
-                raise VCSError('Invalid object path "%s" in:\n %s' %
-                               (object_path, json.dumps(data)))
-
-            page_info = json_path(objects, ('pageInfo',))
-            if page_info is None:
-                yield objects
-                return
-            # This is due to inconsistency in graphql API.
-            # In most cases, requests returning lists of objects put them in
-            # 'nodes', but in few legacy methods they use 'edges'
-            nodes = objects.get('nodes', objects.get('edges'))
-            if nodes is None:
-                raise EnvironmentError(
-                    'Unexpected result format. Please report an issue:\n'
-                    'https://github.com/CMUSTRUDEL/strudel.scraper/issues/new')
-
-            for obj in nodes:
-                yield obj
-            if not json_path(page_info, ('hasNextPage',)):
-                break
+            res = self._extract(r, 'graphql')
+            nodes, page_info = self._parse_v4(res, object_path)
+            yield nodes, page_info
             # the result is single page, or there are no more pages
+            if page_info is None or \
+                    not json_path(page_info, ('hasNextPage',)):
+                return
             params['cursor'] = json_path(page_info, ('endCursor',))
 
     def __call__(self, query, object_path=None, **params):
@@ -559,49 +639,172 @@ class GitHubAPIv4(GitHubAPI):
                     pageInfo {endCursor, hasNextPage}
             }}}""", ('repository', 'stargazers'), owner=owner, repo=repo)
 
+    # default fields for batch_repo_info(); see
+    # https://docs.github.com/en/graphql/reference/objects#repository
+    repo_info_fields = """
+        nameWithOwner, description, isFork, createdAt, updatedAt, pushedAt
+        forkCount, stargazerCount, primaryLanguage {name}
+        issues(states: OPEN) {totalCount}
+        repositoryTopics(first: 100) {nodes {topic {name}}}"""
 
-def get_limits(tokens=None):
-    """Get human-readable rate usage limit.
+    def batch_repo_info(self, slugs, fields=None, batch_size=50):
+        """ Get info for many repositories, `batch_size` per request
 
-    Returns a generator of dictionaries with columns:
+        Every batch is fetched by a single GraphQL query, with one aliased
+        `repository` object per repo. Missing repositories do not fail the
+        whole batch; instead, RepoDoesNotExist is returned for them.
 
-    """
-    api = GitHubAPI(tokens)
-    now = datetime.now()
+        >>> for slug, info in GitHubAPIv4().batch_repo_info(slugs):
+        ...     if isinstance(info, Exception):
+        ...         continue
+
+        Args:
+            slugs (Iterable[str]): repository slugs, e.g. "owner/name"
+            fields (Union[str, Iterable[str]]): GraphQL repository fields to
+                fetch. Defaults to `repo_info_fields`.
+            batch_size (int): number of repositories per query. GitHub limits
+                query complexity, so it rarely makes sense to go over 100.
+
+        Generates:
+            Tuple[str, Union[dict, Exception]]: slug and repository
+                info, or an exception if the repository can't be fetched
+        """
+        fields = fields or self.repo_info_fields
+        if not isinstance(fields, six.string_types):
+            fields = ", ".join(fields)
+
+        slugs = iter(slugs)
+        while True:
+            batch = list(itertools.islice(slugs, batch_size))
+            if not batch:
+                return
 
-    for i, token in enumerate(api.tokens):
-        # if limit is exhausted there is no way to get username
-        user = token.user or '<unknown%d>' % i
-        values = {'user': user, 'key': token.token}
+            aliases = []
+            for i, slug in enumerate(batch):
+                owner, _, name = slug.partition('/')
+                aliases.append('r%d: repository(owner: %s, name: %s) {%s}' % (
+                    i, json.dumps(owner), json.dumps(name), fields))
+            payload = json.dumps(
+                {'query': 'query {\n%s\n}' % '\n'.join(aliases)})
+
+            r = self._request('graphql', 'post', data=payload)
+            res = self._extract(r, 'graphql')
+
+            errors = {}
+            for error in res.get('errors') or ():
+                path = error.get('path') or ()
+                if not path or path[0] not in (res.get('data') or {}):
+                    # not specific to a repository, e.g. invalid fields
+                    raise VCSError('API didn\'t return any data:\n' +
+                                   json.dumps(res, indent=4))
+                if error.get('type') == 'NOT_FOUND':
+                    exc = RepoDoesNotExist
+                else:
+                    exc = VCSError
+                errors[path[0]] = exc(error.get('message'))
+
+            for i, slug in enumerate(batch):
+                alias = 'r%d' % i
+                if alias in errors:
+                    yield slug, errors[alias]
+                else:
+                    yield slug, res['data'][alias]
+
+
+def _token_limits(token, i, refresh=True):
+    """ Get human-readable limits of a single token """
+    now = datetime.now()
+    # if limit is exhausted there is no way to get username
+    user = token.user or '<unknown%d>' % i
+    values = {'user': user, 'key': token.token}
+    if refresh:
         token.check_limits()
+    else:  # use limits from response headers or the quota store
+        for api_class in token.api_classes:
+            token._sync_limits(api_class, force=True)
+
+    for api_class, limits in token.limits.items():
+        next_update = limits.get('reset')
+        if next_update is None:
+            renew = 'never'
+        else:
+            tdiff = datetime.fromtimestamp(next_update) - now
+            renew = '%dm%ds' % divmod(tdiff.seconds, 60)
+        values[api_class + '_renews_in'] = renew
+        values[api_class + '_limit'] = limits.get('limit')
+        values[api_class + '_remaining'] = limits.get('remaining')
+    return values
+
+
+def get_limits(tokens=None, refresh=True, concurrency=16, api=None):
+    """Get human-readable rate usage limit.
 
-        for api_class in token.limits:
-            next_update = token.limits[api_class]['reset']
-            if next_update is None:
-                renew = 'never'
-            else:
-                tdiff = datetime.fromtimestamp(next_update) - now
-                renew = '%dm%ds' % divmod(tdiff.seconds, 60)
-            values[api_class + '_renews_in'] = renew
-            values[api_class + '_limit'] = token.limits[api_class]['limit']
-            values[api_class + '_remaining'] = token.limits[api_class]['remaining']
+    Tokens are checked concurrently, and results are generated as they
+    arrive, i.e. not necessarily in the order of tokens.
+
+    Args:
+        tokens (Optional[Union[Iterable,str]]): tokens to check, by default
+            all tokens of GitHubAPI
+        refresh (bool): whether to request the rate_limit endpoint, or to
+            report limits known from response headers and the quota store
+        concurrency (int): max number of tokens checked in parallel
+        api (Optional[GitHubAPI]): API instance to check tokens of,
+            instead of `tokens`
 
-        yield values
+    Returns a generator of dictionaries with columns:
+        user, key, and <api_class>_limit, _remaining, _renews_in
+        for every API class (core, search)
+    """
+    from concurrent import futures
+    api = api or GitHubAPI(tokens)
+    if not api.tokens:
+        return
+
+    with futures.ThreadPoolExecutor(
+            max_workers=min(concurrency, len(api.tokens))) as executor:
+        jobs = [executor.submit(_token_limits, token, i, refresh)
+                for i, token in enumerate(api.tokens)]
+        for job in futures.as_completed(jobs):
+            yield job.result()
 
 
 def print_limits(argv=None):
     """Check remaining limits of registered GitHub API keys"""
+    import argparse
+    parser = argparse.ArgumentParser(description=print_limits.__doc__)
+    parser.add_argument(
+        '--watch', type=int, metavar='SECONDS', default=0,
+        help="refresh the table every SECONDS seconds using limits known "
+             "from response headers and GITHUB_API_QUOTA_STORE, without "
+             "spending extra rate_limit calls. Without the quota store, "
+             "limits are requested every time")
+    # ignore arguments of the caller, e.g. unittest
+    args, _ = parser.parse_known_args(argv)
 
     columns = ('user', 'core_limit', 'core_remaining', 'core_renews_in',
                'search_limit', 'search_remaining', 'search_renews_in',
                'key')
-
-    stats = list(get_limits())
-
-    lens = {column: max(max(len(str(values[column])), len(column))
-                        for values in stats)
-            for column in columns}
-
-    print('\n', ' '.join(c.ljust(lens[c] + 1, " ") for c in columns))
-    for values in stats:
-        print(*(str(values[c]).ljust(lens[c] + 1, " ") for c in columns))
+    # rows are printed as they arrive, so widths can't be adjusted to data
+    lens = {column: len(column) for column in columns}
+    lens['user'] = 20
+    lens['key'] = 40
+
+    api = GitHubAPI()
+    # this process doesn't make other requests, so without the quota store
+    # limits known from response headers would never change
+    watch_store = api.quota_store is not None
+    if args.watch and not watch_store:
+        warnings.warn("GITHUB_API_QUOTA_STORE is not set, so limits of other "
+                      "processes are not visible. Requesting rate_limit "
+                      "on every refresh instead", Warning)
+
+    refresh = True
+    while True:
+        print('\n', ' '.join(c.ljust(lens[c] + 1, " ") for c in columns))
+        for values in get_limits(refresh=refresh, api=api):
+            print(*(str(values.get(c)).ljust(lens[c] + 1, " ")
+                    for c in columns))
+        if not args.watch:
+            return
+        refresh = not watch_store
+        time.sleep(args.watch)
@@ -0,0 +1,121 @@
+""" Incremental crawls of repository history.
+
+Every run records a per-repository, per-endpoint high-water mark (the latest
+`updated_at`, event id or commit SHA), so that the next run only fetches
+what has changed since:
+
+>>> from stscraper.incremental import IncrementalCrawler, SQLiteSyncState
+>>> crawler = IncrementalCrawler(GitHubAPI(), SQLiteSyncState('sync.sqlite'))
+>>> new_issues = list(crawler.repo_issues('pandas-dev/pandas'))
+
+Marks are only saved when the generator is exhausted, so an interrupted
+crawl is repeated in full next time rather than leaving a gap.
+"""
+
+from __future__ import absolute_import
+
+import os
+import sqlite3
+import threading
+
+
+class SyncState(object):
+    """ An abstract storage for high-water marks """
+
+    def get(self, repo, endpoint):
+        # type: (str, str) -> Optional[str]
+        raise NotImplementedError
+
+    def set(self, repo, endpoint, mark):
+        # type: (str, str, str) -> None
+        raise NotImplementedError
+
+
+class SQLiteSyncState(SyncState):
+    """ High-water marks stored in a SQLite database """
+    def __init__(self, path):
+        path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS marks (repo TEXT, endpoint TEXT, '
+                'mark TEXT, PRIMARY KEY (repo, endpoint))')
+
+    def get(self, repo, endpoint):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT mark FROM marks WHERE repo = ? AND endpoint = ?',
+                (repo, endpoint)).fetchone()
+        return row and row[0]
+
+    def set(self, repo, endpoint, mark):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO marks VALUES (?, ?, ?)',
+                             (repo, endpoint, mark))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class IncrementalCrawler(object):
+    """ Fetch only records added or updated since the previous run.
+
+    Issues and comments are requested with the `since` parameter, so records
+    updated exactly at the mark can be returned twice. Events and commits
+    don't support it; they are listed newest first and pagination stops at
+    the mark.
+
+    Args:
+        api (GitHubAPI): REST API instance
+        state (SyncState): high-water mark storage
+    """
+    def __init__(self, api, state):
+        self.api = api
+        self.state = state
+
+    def _since(self, repo, endpoint, method):
+        mark = self.state.get(repo, endpoint)
+        params = {'sort': 'updated', 'direction': 'asc'}
+        if mark:
+            params['since'] = mark
+        new_mark = mark
+        for item in method(repo, **params):
+            new_mark = max(new_mark or '', item['updated_at'])
+            yield item
+        if new_mark:
+            self.state.set(repo, endpoint, new_mark)
+
+    def _until(self, repo, endpoint, method, key, reached):
+        mark = self.state.get(repo, endpoint)
+        new_mark = None
+        for item in method(repo):
+            if new_mark is None:
+                new_mark = str(item[key])
+            if mark is not None and reached(item[key], mark):
+                break
+            yield item
+        if new_mark is not None:
+            self.state.set(repo, endpoint, new_mark)
+
+    def repo_issues(self, repo_slug):
+        """ Issues created or updated since the last run """
+        return self._since(repo_slug, 'issues', self.api.repo_issues)
+
+    def repo_issue_comments(self, repo_slug):
+        """ Issue comments created or updated since the last run """
+        return self._since(repo_slug, 'issue_comments',
+                           self.api.repo_issue_comments)
+
+    def repo_issue_events(self, repo_slug):
+        """ Issue events since the last run, newest first """
+        return self._until(repo_slug, 'issue_events',
+                           self.api.repo_issue_events, 'id',
+                           lambda event_id, mark: event_id <= int(mark))
+
+    def repo_commits(self, repo_slug):
+        """ Commits added to the default branch since the last run,
+        newest first """
+        return self._until(repo_slug, 'commits', self.api.repo_commits,
+                           'sha', lambda sha, mark: sha == mark)
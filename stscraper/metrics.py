@@ -0,0 +1,194 @@
+""" Request metrics and tracing hooks.
+
+To find out where crawl time goes, pass a Metrics registry to the API:
+
+>>> metrics = Metrics()
+>>> api = GitHubAPI(metrics=metrics)
+>>> stop = metrics.log_periodically(600)  # log a summary every 10 minutes
+>>> print(metrics.prometheus())  # or export in Prometheus text format
+
+Recorded metrics:
+
+- request_seconds: histogram of API response time, by endpoint class
+- decode_seconds: histogram of response parsing time, by endpoint class
+- received_bytes: counter of response body sizes, by endpoint class
+- responses: counter of responses, by endpoint class and status code
+- token_requests: counter of requests, by token hash prefix
+- retries: counter of retries, by endpoint class and reason
+- backoff_seconds: counter of time spent sleeping before retries
+- token_wait_seconds: counter of time spent waiting for rate limit reset
+
+Callbacks added by `add_listener()` are called with every observation as
+`callback(name, value, labels)`, e.g. to forward them to another system.
+"""
+
+from __future__ import absolute_import
+
+import bisect
+import collections
+import logging
+import re
+import threading
+
+# histogram buckets, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_NUMBER = re.compile(r'^\d+$')
+_SHA = re.compile(r'^[0-9a-f]{40}$')
+
+
+def endpoint_class(url):
+    # type: (str) -> str
+    """ Replace identifiers in API URL, to group similar requests
+
+    >>> endpoint_class('repos/pandas-dev/pandas/issues/123/comments')
+    'repos/:owner/:repo/issues/:id/comments'
+    >>> endpoint_class('users/user2589')
+    'users/:user'
+    """
+    chunks = url.split('?', 1)[0].strip('/').split('/')
+    if chunks[0] == 'repos' and len(chunks) > 2:
+        chunks[1:3] = [':owner', ':repo']
+    elif chunks[0] in ('users', 'orgs') and len(chunks) > 1:
+        chunks[1] = ':' + chunks[0][:-1]
+    return '/'.join(
+        ':id' if _NUMBER.match(chunk) else ':sha' if _SHA.match(chunk)
+        else chunk for chunk in chunks)
+
+
+class Histogram(object):
+    """ Cumulative histogram with fixed buckets """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """ Approximate quantile: upper bound of the bucket containing it """
+        target = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= target:
+                return bound
+        return float('inf')
+
+
+class Metrics(object):
+    """ Thread-safe in-process registry of counters and histograms """
+
+    def __init__(self, prefix='stscraper_'):
+        self.prefix = prefix
+        self.counters = collections.defaultdict(float)
+        self.histograms = {}
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, callback):
+        """ Call `callback(name, value, labels)` on every observation """
+        self.listeners.append(callback)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += value
+        for callback in self.listeners:
+            callback(name, value, labels)
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+        for callback in self.listeners:
+            callback(name, value, labels)
+
+    def counter(self, name, **labels):
+        """ Get counter value; if labels are omitted, sum over all labels """
+        labels = set(labels.items())
+        with self._lock:
+            return sum(value for (n, key), value in self.counters.items()
+                       if n == name and labels.issubset(key))
+
+    @staticmethod
+    def _labels(labels, **extra):
+        labels = list(labels) + sorted(extra.items())
+        if not labels:
+            return ''
+        return '{%s}' % ','.join(
+            '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+            for k, v in labels)
+
+    def prometheus(self):
+        # type: () -> str
+        """ Export metrics in Prometheus text format """
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (key, (list(h.counts), h.sum, h.count, h.buckets))
+                for key, h in self.histograms.items())
+        seen = set()
+        for (name, labels), value in counters:
+            name = self.prefix + name
+            if name not in seen:
+                lines.append('# TYPE %s counter' % name)
+                seen.add(name)
+            lines.append('%s%s %s' % (name, self._labels(labels), value))
+        for (name, labels), (counts, total, count, buckets) in histograms:
+            name = self.prefix + name
+            if name not in seen:
+                lines.append('# TYPE %s histogram' % name)
+                seen.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append('%s_bucket%s %d' % (
+                    name, self._labels(labels, le=bound), cumulative))
+            lines.append('%s_sum%s %s' % (name, self._labels(labels), total))
+            lines.append('%s_count%s %d' % (
+                name, self._labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        # type: () -> str
+        """ Human-readable summary of request latency and waits """
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+        for (name, labels), h in histograms:
+            lines.append('%s %s: %d, mean %.3fs, p50 <%ss, p95 <%ss' % (
+                name, ' '.join('%s=%s' % label for label in labels), h.count,
+                h.sum / h.count, h.quantile(0.5), h.quantile(0.95)))
+        for name in ('retries', 'backoff_seconds', 'token_wait_seconds',
+                     'received_bytes'):
+            lines.append('%s: %g' % (name, self.counter(name)))
+        return '\n'.join(lines)
+
+    def log_periodically(self, interval, logger=None):
+        """ Log summary every `interval` seconds in a background thread
+
+        Returns:
+            threading.Event: set it to stop logging
+        """
+        logger = logger or logging.getLogger('scraper.metrics')
+        stop = threading.Event()
+
+        def log():
+            while not stop.wait(interval):
+                logger.info("API metrics:\n%s", self.summary())
+
+        thread = threading.Thread(target=log)
+        thread.daemon = True
+        thread.start()
+        return stop
@@ -0,0 +1,298 @@
+""" A local stand-in for api.github.com, for tests and benchmarks.
+
+It serves synthetic data for the REST endpoints used by GitHubAPI, with Link
+pagination, X-RateLimit headers and ETags, and a GraphQL endpoint with
+pageInfo pagination. Latency, error rate and per-token quota are
+configurable:
+
+>>> with MockGitHub(latency=0.05, error_rate=0.01) as server:
+...     api = server.api(GitHubAPI, tokens=4)
+...     issues = list(api.repo_issues('owner/repo'))
+
+Repositories which names start with "missing" don't exist.
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, urlparse
+
+from .github import parse_graphql_path
+
+# endpoint suffix: attribute of generated items
+PAGINATED = {
+    'issues': 'number',
+    'pulls': 'number',
+    'commits': 'sha',
+    'issues/comments': 'id',
+    'issues/events': 'id',
+    'labels': 'name',
+    'stargazers': 'login',
+}
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.mock.handle(self, 'get')
+
+    def do_POST(self):
+        self.server.mock.handle(self, 'post')
+
+
+class MockGitHub(object):
+    """ Local HTTP server emulating GitHub API
+
+    Args:
+        latency (float): seconds to wait before every response
+        error_rate (float): probability of 502 response
+        quota (int): number of requests per token per hour
+        items (int): number of items in every paginated list
+        seed (int): random seed for errors
+    """
+    def __init__(self, latency=0, error_rate=0, quota=5000, items=1000,
+                 seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota = quota
+        self.items = items
+        self.random = random.Random(seed)
+        self.reset = int(time.time()) + 3600
+        self.requests = 0  # total number of requests served
+        self.pages = 0  # pages of paginated lists served, REST and GraphQL
+        self._remaining = {}  # token: remaining quota
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/' % self._server.server_address[1]
+
+    def start(self):
+        self._server = _Server(('127.0.0.1', 0), _Handler)
+        self._server.mock = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def api(self, api_class, tokens=1, **kwargs):
+        """ Get an instance of API class talking to this server
+
+        Args:
+            api_class (type): GitHubAPI or its subclass
+            tokens (int): number of distinct tokens to use
+        """
+        token_class = type('Mock' + api_class.token_class.__name__,
+                           (api_class.token_class,), {'api_url': self.url})
+        cls = type('Mock' + api_class.__name__, (api_class,),
+                   {'token_class': token_class})
+        return cls(['%040d' % i for i in range(tokens)], **kwargs)
+
+    # ===================================
+    #         Request handling
+    # ===================================
+    def _charge(self, token):
+        """ Returns remaining quota, or -1 if it is exhausted """
+        with self._lock:
+            self.requests += 1
+            remaining = self._remaining.get(token, self.quota)
+            if not remaining:
+                return -1
+            self._remaining[token] = remaining - 1
+            return remaining - 1
+
+    def handle(self, request, method):
+        if self.latency:
+            time.sleep(self.latency)
+        token = request.headers.get('Authorization', 'anonymous')
+        url = urlparse(request.path)
+        path = url.path.strip('/')
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = None
+        if method == 'post':
+            length = int(request.headers.get('Content-Length', 0))
+            body = json.loads(request.rfile.read(length).decode('utf8'))
+
+        if self.random.random() < self.error_rate:
+            return self._respond(request, 502, {'message': 'Bad Gateway'})
+
+        if path == 'rate_limit':  # free
+            remaining = self._remaining.get(token, self.quota)
+        else:
+            remaining = self._charge(token)
+        headers = {
+            'X-RateLimit-Limit': str(self.quota),
+            'X-RateLimit-Remaining': str(max(remaining, 0)),
+            'X-RateLimit-Reset': str(self.reset),
+        }
+        if remaining < 0:
+            return self._respond(request, 403, {
+                'message': 'API rate limit exceeded'}, headers)
+
+        if method == 'post' and path == 'graphql':
+            status, data = 200, self._graphql(body)
+        else:
+            status, data = self._rest(path, params, headers, token)
+
+        payload = json.dumps(data).encode('utf8')
+        etag = '"%s"' % hashlib.md5(payload).hexdigest()
+        if status == 200 and method == 'get':
+            headers['ETag'] = etag
+            if request.headers.get('If-None-Match') == etag:
+                # 304 are not charged by GitHub
+                with self._lock:
+                    self._remaining[token] += 1
+                headers['X-RateLimit-Remaining'] = str(remaining + 1)
+                return self._respond(request, 304, None, headers)
+        return self._respond(request, status, payload, headers)
+
+    @staticmethod
+    def _respond(request, status, payload, headers=None):
+        if payload is not None and not isinstance(payload, bytes):
+            payload = json.dumps(payload).encode('utf8')
+        request.send_response(status)
+        for header, value in (headers or {}).items():
+            request.send_header(header, value)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(payload or b'')))
+        request.end_headers()
+        if payload:
+            request.wfile.write(payload)
+
+    def _rest(self, path, params, headers, token):
+        chunks = path.split('/')
+        if path == 'user':
+            return 200, {'login': 'mock-user-' + token[-4:]}
+        if path == 'rate_limit':
+            limits = {'limit': self.quota, 'reset': self.reset,
+                      'remaining': int(headers['X-RateLimit-Remaining'])}
+            return 200, {'resources': {'core': limits, 'search': dict(
+                limits, limit=30, remaining=30)}}
+        if chunks[0] == 'users' and len(chunks) == 2:
+            return 200, {'login': chunks[1], 'type': 'User'}
+        if chunks[0] != 'repos' or len(chunks) < 3:
+            return 404, {'message': 'Not Found'}
+        slug, endpoint = '/'.join(chunks[1:3]), '/'.join(chunks[3:])
+        if chunks[2].startswith('missing'):
+            return 404, {'message': 'Not Found'}
+        if not endpoint:
+            return 200, self._repo(slug)
+        if endpoint == 'topics':
+            return 200, {'names': ['mock', 'topic']}
+        if endpoint not in PAGINATED:
+            return 404, {'message': 'Not Found'}
+
+        with self._lock:
+            self.pages += 1
+        page = int(params.get('page', 1))
+        per_page = int(params.get('per_page', 30))
+        last_page = max(1, -(-self.items // per_page))
+        start = (page - 1) * per_page
+        items = [self._item(slug, endpoint, i)
+                 for i in range(start, min(start + per_page, self.items))]
+        links = []
+        if page < last_page:
+            links.append('<%s%s?page=%d&per_page=%d>; rel="next"' % (
+                self.url, path, page + 1, per_page))
+            links.append('<%s%s?page=%d&per_page=%d>; rel="last"' % (
+                self.url, path, last_page, per_page))
+        if links:
+            headers['Link'] = ', '.join(links)
+        return 200, items
+
+    @staticmethod
+    def _repo(slug):
+        return {
+            'full_name': slug, 'name': slug.split('/')[1], 'fork': False,
+            'topics': ['mock', 'topic'], 'open_issues_count': 1,
+            'open_issues': 1, 'forks_count': 2, 'stargazers_count': 3,
+            'description': 'Mock repository', 'language': 'Python',
+            'created_at': '2020-01-01T00:00:00Z',
+            'updated_at': '2020-01-02T00:00:00Z',
+            'pushed_at': '2020-01-03T00:00:00Z',
+        }
+
+    def _item(self, slug, endpoint, i):
+        # items are listed newest first, like in GitHub API
+        n = self.items - i
+        date = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1.5e9 + n))
+        key = PAGINATED[endpoint]
+        return {
+            key: n if key in ('number', 'id') else '%s-%d' % (key, n),
+            'title': 'Item %d of %s' % (n, slug),
+            'body': 'Lorem ipsum dolor sit amet. ' * 10,
+            'user': {'login': 'user%d' % (n % 100)},
+            'author': {'login': 'user%d' % (n % 100)},
+            'parents': [{'sha': 'sha-%d' % (n - 1)}],
+            'commit': {'author': {'date': date}, 'message': 'Commit %d' % n},
+            'labels': [{'name': 'bug'}] if n % 3 else [],
+            'created_at': date, 'updated_at': date,
+        }
+
+    def _graphql(self, body):
+        query = body.get('query', '')
+        variables = body.get('variables') or {}
+
+        aliases = re.findall(
+            r'(\w+): repository\(owner: "([^"]*)", name: "([^"]*)"\)', query)
+        if aliases:
+            data, errors = {}, []
+            for alias, owner, name in aliases:
+                if name.startswith('missing'):
+                    data[alias] = None
+                    errors.append({'type': 'NOT_FOUND', 'path': [alias],
+                                   'message': 'Could not resolve to a '
+                                              'Repository'})
+                else:
+                    data[alias] = {'nameWithOwner': owner + '/' + name,
+                                   'stargazerCount': 3, 'forkCount': 2}
+            res = {'data': data}
+            if errors:
+                res['errors'] = errors
+            return res
+
+        path = parse_graphql_path(query)
+        if not path:
+            return {'errors': [{'message': 'Parse error'}]}
+        if 'pageInfo' in query:
+            with self._lock:
+                self.pages += 1
+            cursor = int(variables.get('cursor') or 0)
+            count = min(100, self.items - cursor)
+            obj = {'nodes': [{'login': 'user%d' % i, 'id': i}
+                             for i in range(cursor, cursor + count)],
+                   'pageInfo': {'endCursor': str(cursor + count),
+                                'hasNextPage': cursor + count < self.items}}
+        else:
+            obj = {'login': variables.get('user', 'mock-user'), 'id': 1}
+        for chunk in reversed(path):
+            obj = {chunk: obj}
+        return {'data': obj}
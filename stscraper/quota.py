@@ -0,0 +1,165 @@
+""" Rate limit information shared by multiple processes.
+
+Normally every process keeps its own copy of token limits and only learns
+that a token is exhausted by the API response. When several crawlers on the
+same host use the same tokens, a shared quota store lets them schedule tokens
+globally:
+
+>>> from stscraper.quota import SQLiteQuotaStore
+>>> api = GitHubAPI(quota_store=SQLiteQuotaStore('/tmp/github_quota.sqlite'))
+
+The store also remembers token owners, so that tokens don't have to be
+validated again by every new process.
+Tokens are stored as hashes, so the store doesn't expose secrets.
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import os
+import threading
+import time
+
+
+def token_id(token):
+    # type: (Optional[str]) -> str
+    """ Identify a token without revealing it """
+    if token is None:
+        return 'anonymous'
+    return hashlib.sha1(token.encode('utf8')).hexdigest()
+
+
+class QuotaStore(object):
+    """ An abstract storage for rate limits of API tokens.
+    Limits are dictionaries with `remaining`, `reset` and `limit` keys,
+    i.e. the same format as used by GitHubAPIToken
+    """
+
+    def get(self, token, api_class):
+        # type: (str, str) -> Optional[dict]
+        """ Get the latest known limits of a token """
+        raise NotImplementedError
+
+    def update(self, token, api_class, limits):
+        # type: (str, str, dict) -> None
+        """ Record limits reported by the API """
+        raise NotImplementedError
+
+    def claim(self, token, api_class):
+        # type: (str, str) -> bool
+        """ Atomically reserve a request on the token.
+
+        Returns:
+            bool: False if the token is known to be exhausted
+        """
+        raise NotImplementedError
+
+    def get_user(self, token, ttl):
+        # type: (str, int) -> Optional[str]
+        """ Get the owner of a token, if it was checked within `ttl` seconds.
+        Stores not implementing it make tokens check their owner every time.
+        """
+        return None
+
+    def set_user(self, token, user):
+        # type: (str, str) -> None
+        """ Record the owner of a token """
+        pass
+
+
+class SQLiteQuotaStore(QuotaStore):
+    """ Quota store in a SQLite database, shared by all processes using the
+    same file. Write-ahead log mode allows concurrent readers.
+    """
+    def __init__(self, path, timeout=30):
+        path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        import sqlite3  # only needed with a store, keep package import fast
+        # autocommit mode; transactions are managed explicitly
+        self._db = sqlite3.connect(path, timeout=timeout,
+                                   check_same_thread=False,
+                                   isolation_level=None)
+        with self._lock:
+            if path != ':memory:':
+                self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS limits (token TEXT, '
+                'api_class TEXT, remaining INTEGER, reset INTEGER, '
+                'total INTEGER, PRIMARY KEY (token, api_class))')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS users (token TEXT PRIMARY KEY, '
+                'user TEXT, checked INTEGER)')
+
+    def get(self, token, api_class):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT remaining, reset, total FROM limits '
+                'WHERE token = ? AND api_class = ?',
+                (token, api_class)).fetchone()
+        if row is None:
+            return None
+        return {'remaining': row[0], 'reset': row[1], 'limit': row[2]}
+
+    def update(self, token, api_class, limits):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute(
+                    'SELECT remaining, reset FROM limits '
+                    'WHERE token = ? AND api_class = ?',
+                    (token, api_class)).fetchone()
+                remaining = limits['remaining']
+                if row is not None and row[1] == limits['reset'] \
+                        and row[0] is not None:
+                    # responses to concurrent requests may arrive out of
+                    # order; within the same window, remaining only goes down
+                    remaining = min(row[0], remaining)
+                self._db.execute(
+                    'INSERT OR REPLACE INTO limits VALUES (?, ?, ?, ?, ?)',
+                    (token, api_class, remaining, limits['reset'],
+                     limits['limit']))
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def claim(self, token, api_class):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute(
+                    'SELECT remaining, reset FROM limits '
+                    'WHERE token = ? AND api_class = ?',
+                    (token, api_class)).fetchone()
+                if row is None or row[0] is None:
+                    claimed = True  # nothing is known about this token yet
+                elif row[0] > 0:
+                    self._db.execute(
+                        'UPDATE limits SET remaining = remaining - 1 '
+                        'WHERE token = ? AND api_class = ?',
+                        (token, api_class))
+                    claimed = True
+                else:
+                    # exhausted, unless the limit was reset since
+                    claimed = row[1] is not None and row[1] <= time.time()
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+        return claimed
+
+    def get_user(self, token, ttl):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT user FROM users WHERE token = ? AND checked > ?',
+                (token, int(time.time()) - ttl)).fetchone()
+        return row and row[0]
+
+    def set_user(self, token, user):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO users VALUES (?, ?, ?)',
+                             (token, user, int(time.time())))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
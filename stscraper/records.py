@@ -0,0 +1,167 @@
+""" Compact record types for high-volume streams.
+
+Decoded API objects are nested dictionaries with dozens of fields, which
+takes a few kilobytes per commit or issue. When millions of them have to be
+kept in memory, pass a record constructor as `fields` to keep only what is
+needed:
+
+>>> commits = list(api.repo_commits('pandas-dev/pandas',
+...                                 fields=Commit.from_json))
+>>> commits[0].sha, commits[0].author, commits[0].authored_at
+('f1b8e1c...', 'jreback', 1600000000)
+
+Records are produced page by page, so full objects are released as soon as
+the page is processed. They use `__slots__` instead of a dictionary per
+object, keep dates as Unix timestamps and share repeated user logins.
+A commit record takes about ten times less memory than the decoded commit,
+and a third less than a dictionary with the same fields (see benchmark.py).
+For columnar processing, see `CompiledMapping.columns()` instead.
+
+Records support `record['field']` and `get()` like dictionaries, so they can
+be written to sinks directly, and `to_dict()` for everything else.
+"""
+
+from __future__ import absolute_import
+
+import calendar
+
+from six.moves import intern
+
+
+def _shared(string):
+    # type: (Optional[str]) -> Optional[str]
+    """ Share logins and other repeated strings between records.
+    Interned strings are freed once no record refers to them """
+    if not string:
+        return string
+    try:
+        return intern(string)
+    except TypeError:  # Python 2 only interns byte strings
+        try:
+            return intern(string.encode('ascii'))
+        except UnicodeError:
+            return string
+
+
+def timestamp(date):
+    # type: (Optional[str]) -> Optional[int]
+    """ Convert GitHub API date to Unix timestamp
+
+    >>> timestamp('2020-01-01T00:00:00Z')
+    1577836800
+    """
+    if not date:
+        return None
+    # much faster than strptime; GitHub API dates are always UTC
+    return calendar.timegm((
+        int(date[:4]), int(date[5:7]), int(date[8:10]),
+        int(date[11:13]), int(date[14:16]), int(date[17:19])))
+
+
+def _login(user):
+    # type: (Optional[dict]) -> Optional[str]
+    """ Login of a user object, shared by all records of the same user """
+    return user and _shared(user.get('login'))
+
+
+class Record(object):
+    """ Base class for slotted records; subclasses only define `__slots__`
+    and a `from_json()` constructor """
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        for name, value in zip(self.__slots__, args):
+            setattr(self, name, value)
+        for name in self.__slots__[len(args):]:
+            setattr(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError("Unexpected fields: %s" % ', '.join(kwargs))
+
+    @classmethod
+    def from_json(cls, obj):
+        # type: (dict) -> Record
+        raise NotImplementedError
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self.__slots__)
+
+    def __getitem__(self, name):
+        if name not in self.__slots__:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        return getattr(self, name, default) if name in self.__slots__ \
+            else default
+
+    def to_dict(self):
+        # type: () -> dict
+        return dict(zip(self.__slots__, self))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __reduce__(self):
+        return self.__class__, tuple(self)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(
+            '%s=%r' % pair for pair in zip(self.__slots__, self)))
+
+
+class Commit(Record):
+    """ A commit, as listed by `GitHubAPI.repo_commits()`.
+    `author` is the GitHub login, None if the email is not linked to a user.
+    """
+    __slots__ = ('sha', 'author', 'authored_at', 'committed_at', 'parents')
+
+    @classmethod
+    def from_json(cls, commit):
+        # type: (dict) -> Commit
+        details = commit.get('commit') or {}
+        return cls(
+            commit['sha'],
+            _login(commit.get('author')),
+            timestamp((details.get('author') or {}).get('date')),
+            timestamp((details.get('committer') or {}).get('date')),
+            tuple(parent['sha'] for parent in commit.get('parents') or ()))
+
+
+class Issue(Record):
+    """ An issue, as listed by `GitHubAPI.repo_issues()` """
+    __slots__ = ('number', 'author', 'state', 'title', 'created_at',
+                 'updated_at', 'closed_at')
+
+    @classmethod
+    def from_json(cls, issue):
+        # type: (dict) -> Issue
+        return cls(
+            issue['number'],
+            _login(issue.get('user')),
+            _shared(issue.get('state')),
+            issue.get('title'),
+            timestamp(issue.get('created_at')),
+            timestamp(issue.get('updated_at')),
+            timestamp(issue.get('closed_at')))
+
+
+class Stargazer(Record):
+    """ A stargazer, as listed by `GitHubAPI.repo_stargazers()`.
+    `starred_at` is only known if the response includes it, i.e. with
+    `application/vnd.github.star+json` media type.
+    """
+    __slots__ = ('login', 'starred_at')
+
+    @classmethod
+    def from_json(cls, stargazer):
+        # type: (dict) -> Stargazer
+        if 'starred_at' in stargazer:
+            return cls(_login(stargazer.get('user')),
+                       timestamp(stargazer['starred_at']))
+        return cls(_login(stargazer), None)
@@ -0,0 +1,132 @@
+""" Retry policy for failed API requests.
+
+By default, failed requests are retried up to `retries` times with
+decorrelated jitter backoff, so that concurrent workers hitting the same
+problem don't retry in lockstep. Delays are never shorter than requested
+by `Retry-After` header, which GitHub sends with secondary rate limits.
+
+Optionally, retries can be limited per endpoint class (see
+`stscraper.metrics.endpoint_class`) and a circuit breaker can stop requests
+to an endpoint class which keeps failing:
+
+>>> policy = RetryPolicy(budget=100, breaker_threshold=20)
+>>> api = GitHubAPI(retry_policy=policy)
+
+The policy only makes decisions; both the blocking and the asyncio engines
+do the actual waiting.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import random
+import threading
+import time
+
+
+class RetryPolicy(object):
+    """ When and how long to wait before retrying a request
+
+    Args:
+        retries (int): max number of retries of a single request
+        base (float): min delay between retries, seconds
+        cap (float): max delay between retries, seconds
+        budget (Optional[int]): max number of retries per endpoint class
+            within `budget_window` seconds, unlimited by default
+        budget_window (float): period of retry budget, seconds
+        breaker_threshold (Optional[int]): number of consecutive failures
+            of an endpoint class to stop sending requests to it for
+            `breaker_timeout` seconds. Disabled by default.
+        breaker_timeout (float): how long the circuit stays open. After that,
+            one request is let through; if it succeeds, the circuit closes.
+    """
+    def __init__(self, retries=5, base=1, cap=60, budget=None,
+                 budget_window=60, breaker_threshold=None,
+                 breaker_timeout=60):
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self.budget = budget
+        self.budget_window = budget_window
+        self.breaker_threshold = breaker_threshold
+        self.breaker_timeout = breaker_timeout
+        self._retries = collections.defaultdict(collections.deque)
+        self._failures = collections.defaultdict(int)
+        self._open_until = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def retry_after(response):
+        # type: (object) -> Optional[float]
+        """ Get delay requested by the server, if any """
+        value = response.headers.get('Retry-After')
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):  # missing, or HTTP date
+            return None
+
+    def allow(self, endpoint):
+        # type: (str) -> bool
+        """ Check whether the circuit of an endpoint class is closed """
+        if not self._open_until:
+            return True  # fast path, no lock needed
+        with self._lock:
+            open_until = self._open_until.get(endpoint)
+            if open_until is None:
+                return True
+            if time.time() < open_until:
+                return False
+            # half-open: let one request through and wait for its result
+            self._open_until[endpoint] = time.time() + self.breaker_timeout
+            return True
+
+    def success(self, endpoint):
+        # type: (str) -> None
+        """ Record a successful response, closing the circuit """
+        if not self._failures.get(endpoint):
+            return  # fast path, no lock needed
+        with self._lock:
+            self._failures.pop(endpoint, None)
+            self._open_until.pop(endpoint, None)
+
+    def failure(self, endpoint):
+        # type: (str) -> None
+        """ Record a server or connection error """
+        if self.breaker_threshold is None:
+            return
+        with self._lock:
+            self._failures[endpoint] += 1
+            if self._failures[endpoint] >= self.breaker_threshold:
+                self._open_until[endpoint] = \
+                    time.time() + self.breaker_timeout
+
+    def delay(self, endpoint, attempt, previous=0, retry_after=None):
+        # type: (str, int, float, Optional[float]) -> Optional[float]
+        """ Get the delay before the next retry
+
+        Args:
+            endpoint (str): endpoint class of the request
+            attempt (int): number of this retry, starting from 1
+            previous (float): delay before the previous retry, if any
+            retry_after (Optional[float]): delay requested by the server
+        Returns:
+            Optional[float]: seconds to wait, or None to give up
+        """
+        if attempt > self.retries:
+            return None
+        if self.budget is not None:
+            now = time.time()
+            with self._lock:
+                retries = self._retries[endpoint]
+                while retries and retries[0] < now - self.budget_window:
+                    retries.popleft()
+                if len(retries) >= self.budget:
+                    return None
+                retries.append(now)
+        # decorrelated jitter, see "Exponential Backoff And Jitter"
+        # at the AWS Architecture Blog
+        delay = min(self.cap, random.uniform(
+            self.base, max(self.base, previous) * 3))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
@@ -0,0 +1,319 @@
+""" Record sinks to save scraped data incrementally.
+
+Sinks consume dictionaries (e.g. produced by `json_map`) one at a time and
+append them to a file, so that arbitrarily long streams can be saved in
+constant memory and constant time per record:
+
+>>> with CSVSink('issues.csv', ('number', 'title')) as sink:
+...     for issue in api.repo_issues('pandas-dev/pandas'):
+...         sink.write(issue)
+"""
+
+from __future__ import absolute_import
+
+import csv
+import io
+import itertools
+import json
+import os
+
+import six
+
+from .base import compile_mapping
+
+
+class RecordSink(object):
+    """ Base class for record sinks """
+
+    def write(self, record):
+        # type: (dict) -> None
+        raise NotImplementedError
+
+    def write_all(self, records):
+        # type: (Iterable[dict]) -> None
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CSVSink(RecordSink):
+    """ Append records to a CSV file.
+
+    If the file already exists, records are appended without re-reading it;
+    the header is only written to new files. Lists and dictionaries are
+    stored as JSON strings. Missing fields are left empty.
+    """
+    def __init__(self, path, columns, flush_every=100):
+        # type: (str, Iterable[str], int) -> None
+        self.columns = tuple(columns)
+        self.flush_every = flush_every
+        self._pending = 0
+        new_file = not os.path.isfile(path) or not os.path.getsize(path)
+        if six.PY2:
+            self._file = open(path, 'ab')
+        else:
+            self._file = io.open(path, 'a', newline='', encoding='utf8')
+        self._writer = csv.writer(self._file)
+        if new_file:
+            self._writer.writerow([self._format(c) for c in self.columns])
+
+    @staticmethod
+    def _format(value):
+        if isinstance(value, (list, tuple, dict)):
+            return json.dumps(value)
+        if six.PY2 and isinstance(value, six.text_type):
+            # Python 2 csv module only supports byte strings
+            return value.encode('utf8')
+        return value
+
+    def write(self, record):
+        self._writer.writerow(
+            [self._format(record.get(column)) for column in self.columns])
+        self._pending += 1
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+class ArrowSink(RecordSink):
+    """ Write records to a Parquet or Arrow IPC file, in batches.
+
+    Unlike CSV, columnar formats preserve nested and list values (e.g. repo
+    topics) and are much faster to load. Requires pyarrow.
+
+    >>> mapping = {'number': 'number', 'author': 'user__login',
+    ...            'labels': 'labels', 'created_at': 'created_at'}
+    >>> with ArrowSink('issues.parquet', mapping) as sink:
+    ...     sink.write_all(api.repo_issues('pandas-dev/pandas'))
+
+    Args:
+        path (str): output file path
+        mapping (dict): `json_map` mapping to apply to records. Output
+            columns are mapping keys, in the same order.
+        fmt (str): 'parquet' or 'arrow' (Arrow IPC file format)
+        batch_size (int): number of records per row group (Parquet) or
+            record batch (Arrow). It bounds the memory use.
+        schema (pyarrow.Schema): output schema. By default, it is inferred
+            from the data. Records are buffered until every column has a
+            value, e.g. a non-empty list of labels, or until `infer_rows`
+            records; columns without values by then are stored as strings
+            (lists of strings for empty lists). Specify the schema
+            explicitly if this is not desired.
+        infer_rows (int): max number of records to buffer to infer schema
+    """
+    def __init__(self, path, mapping, fmt='parquet', batch_size=10000,
+                 schema=None, infer_rows=100000):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError("ArrowSink requires pyarrow. "
+                              "Try `pip install pyarrow`")
+        if fmt not in ('parquet', 'arrow'):
+            raise ValueError("Unknown format: %s" % fmt)
+        self._pa = pyarrow
+        self.path = path
+        self.mapping = mapping
+        self.columns = list(mapping)
+        self._extract = compile_mapping(mapping)
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.schema = schema
+        self.infer_rows = infer_rows
+        self._writer = None
+        self._buffer = []
+        self._pending = None  # columns buffered until the schema is known
+        self._types = {}  # column: type inferred from the pending records
+
+    def _unresolved(self, field_type):
+        """ Check if the type has parts inferred from nulls only """
+        types = self._pa.types
+        if types.is_null(field_type):
+            return True
+        if types.is_list(field_type):
+            return self._unresolved(field_type.value_type)
+        if types.is_struct(field_type):
+            return any(self._unresolved(field_type[i].type)
+                       for i in range(field_type.num_fields))
+        return False
+
+    def _resolve(self, field_type):
+        """ Replace parts of the type inferred from nulls with strings """
+        pa = self._pa
+        if pa.types.is_null(field_type):
+            return pa.string()
+        if pa.types.is_list(field_type):
+            return pa.list_(self._resolve(field_type.value_type))
+        if pa.types.is_struct(field_type):
+            return pa.struct([
+                pa.field(field.name, self._resolve(field.type))
+                for field in (field_type[i]
+                              for i in range(field_type.num_fields))])
+        return field_type
+
+    def _infer_schema(self, columns, final=False):
+        """ Buffer columns until their types are known
+
+        Returns:
+            Optional[dict]: all buffered columns once the schema is inferred
+        """
+        if self._pending is None:
+            self._pending = {name: [] for name in self.columns}
+        for name in self.columns:
+            self._pending[name].extend(columns[name])
+            field_type = self._types.get(name)
+            if field_type is None or self._unresolved(field_type):
+                self._types[name] = self._pa.array(self._pending[name]).type
+        rows = len(self._pending[self.columns[0]])
+        if not final and rows < self.infer_rows and any(
+                self._unresolved(t) for t in self._types.values()):
+            return None
+        self.schema = self._pa.schema([
+            self._pa.field(name, self._resolve(self._types[name]))
+            for name in self.columns])
+        columns, self._pending, self._types = self._pending, None, {}
+        return columns
+
+    def _open(self):
+        if self._writer is not None:
+            return
+        if self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(self.path, self.schema)
+        else:
+            self._writer = self._pa.ipc.new_file(self.path, self.schema)
+
+    def write(self, record):
+        self._buffer.append(self._extract(record))
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def write_all(self, records):
+        self.flush()
+        records = iter(records)
+        while True:
+            # records are extracted as they are consumed, without buffering
+            columns = self._extract.columns(
+                itertools.islice(records, self.batch_size))
+            if not columns[self.columns[0]]:
+                return
+            self._write_columns(columns)
+
+    def flush(self):
+        if self._buffer:
+            self._write_columns({name: [row[name] for row in self._buffer]
+                                 for name in self.columns})
+            self._buffer = []
+
+    def _write_columns(self, columns, final=False):
+        if self.schema is None:
+            columns = self._infer_schema(columns, final)
+            if columns is None:
+                return
+        rows = len(columns[self.columns[0]])
+        for start in range(0, rows, self.batch_size):
+            self._write_batch(columns if rows <= self.batch_size else {
+                name: values[start:start + self.batch_size]
+                for name, values in columns.items()})
+
+    def _write_batch(self, columns):
+        pa = self._pa
+        try:
+            arrays = [pa.array(columns[field.name], type=field.type)
+                      for field in self.schema]
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            raise ValueError(
+                "Records do not match the output schema %s: %s. Consider "
+                "passing the schema to ArrowSink explicitly" % (
+                    self.schema, e))
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+        self._open()
+        if self.fmt == 'parquet':
+            self._writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+
+    def close(self):
+        self.flush()
+        if self._pending is not None:  # schema is still not fully known
+            self._write_columns({name: [] for name in self.columns}, True)
+        if self._writer is None and self.schema is not None:
+            self._open()  # empty stream, but the schema is known
+        if self._writer is not None:
+            self._writer.close()
+
+
+class Checkpoint(object):
+    """ Append-only log of completed keys, e.g. repository slugs.
+
+    It is used to resume interrupted crawls without re-reading the output:
+
+    >>> done = Checkpoint('crawl.done', sink)
+    >>> for slug in slugs:
+    ...     if slug in done:
+    ...         continue
+    ...     sink.write(process(slug))
+    ...     done.add(slug)
+
+    Keys are written in batches. If the output `sink` is provided, it is
+    flushed before the checkpoint, so that a crash can only result in
+    a duplicate record but never in a lost one.
+    """
+    def __init__(self, path, sink=None, flush_every=100):
+        # type: (str, Optional[RecordSink], int) -> None
+        self.sink = sink
+        self.flush_every = flush_every
+        self._buffer = []
+        self._done = set()
+        if os.path.isfile(path):
+            with io.open(path, encoding='utf8') as fh:
+                self._done.update(line.rstrip('\n') for line in fh)
+        self._file = io.open(path, 'a', encoding='utf8')
+
+    def __contains__(self, key):
+        return key in self._done
+
+    def __len__(self):
+        return len(self._done)
+
+    def add(self, key):
+        # type: (str) -> None
+        self._done.add(key)
+        self._buffer.append(six.text_type(key) + u'\n')
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self.sink is not None:
+            self.sink.flush()
+        self._file.write(u''.join(self._buffer))
+        self._file.flush()
+        self._buffer = []
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,11 +1,43 @@
 #!/usr/bin/env python
 
 from typing import Generator
+import itertools
+import json
+import re
+import sys
 import unittest
 
 import stscraper
 
 
+class OfflineToken(stscraper.GitHubAPIToken):
+    """ GitHub token that doesn't need network access to be created """
+    is_valid = True
+
+
+class OfflineGitHubAPI(stscraper.GitHubAPI):
+    token_class = OfflineToken
+
+
+class OfflineGitHubAPIv4(stscraper.GitHubAPIv4):
+    token_class = OfflineToken
+
+
+def offline_api(cls, *args, **kwargs):
+    """ Get a fresh instance of a singleton API class """
+    cls._instance = None
+    return cls(*args, **kwargs)
+
+
+def make_response(json_data, status_code=200, headers=None):
+    import requests
+    r = requests.Response()
+    r.status_code = status_code
+    r.headers.update(headers or {})
+    r._content = json.dumps(json_data).encode('utf8')
+    return r
+
+
 class TestBase(unittest.TestCase):
 
     def test_add_keys(self):
@@ -15,6 +47,194 @@ class TestBase(unittest.TestCase):
         self.assertTrue(api2 is api)
         self.assertEqual(len(api.tokens), 4)
 
+    def test_json_decoder(self):
+        response = make_response({'login': u'user\xe9', 'id': 1})
+        self.assertIn('json', stscraper.json_decoders())
+        self.assertRaises(ValueError, stscraper.get_json_decoder, 'nojson')
+        for name in stscraper.json_decoders():
+            api = offline_api(OfflineGitHubAPI, json_decoder=name)
+            self.assertEqual(api.extract_result(response),
+                             {'login': u'user\xe9', 'id': 1})
+
+    def test_retry_policy(self):
+        import time
+        from stscraper.retry import RetryPolicy
+        policy = RetryPolicy(retries=3, base=1, cap=10, budget=4)
+        delays = [policy.delay('a', attempt, 5) for attempt in range(1, 4)]
+        self.assertTrue(all(1 <= delay <= 10 for delay in delays))
+        self.assertIsNone(policy.delay('a', 4))
+        self.assertEqual(policy.delay('a', 1, 1, retry_after=30), 30)
+        # the budget of 4 retries per minute is spent
+        self.assertIsNone(policy.delay('a', 1))
+        self.assertIsNotNone(policy.delay('b', 1))
+
+        response = make_response({}, 403, {'Retry-After': '7'})
+        self.assertEqual(policy.retry_after(response), 7)
+        self.assertIsNone(policy.retry_after(make_response({})))
+
+        policy = RetryPolicy(breaker_threshold=2, breaker_timeout=0.05)
+        policy.failure('a')
+        self.assertTrue(policy.allow('a'))
+        policy.failure('a')
+        self.assertFalse(policy.allow('a'))
+        self.assertTrue(policy.allow('b'))
+        time.sleep(0.05)
+        self.assertTrue(policy.allow('a'))  # half-open
+        self.assertFalse(policy.allow('a'))
+        policy.success('a')
+        self.assertTrue(policy.allow('a'))
+
+    def test_lazy_imports(self):
+        import subprocess
+        # heavy dependencies should only be loaded on first use
+        modules = ('stutils', 'pandas', 'sqlite3', 'concurrent.futures',
+                   'orjson', 'simdjson')
+        loaded = subprocess.check_output([
+            sys.executable, '-c', 'import sys, stscraper; print(" ".join('
+            'm for m in %r if m in sys.modules))' % (modules,)])
+        self.assertEqual(loaded.strip(), b'')
+
+    def test_compile_mapping(self):
+        mapping = {'login': 'user__login', 'labels': 'labels__,name',
+                   'number': 'number', 'missing': 'assignee__login'}
+        objs = [{'number': 1, 'user': {'login': 'a'}, 'assignee': None,
+                 'labels': [{'name': 'bug'}, {'name': 'ui'}]},
+                {'number': 2, 'user': None, 'labels': []},
+                {}]
+        extract = stscraper.compile_mapping(mapping)
+        for obj in objs:
+            self.assertEqual(extract(obj), stscraper.json_map(mapping, obj))
+        self.assertEqual(extract.columns(iter(objs)), {
+            'login': ['a', None, None], 'labels': ['bug,ui', '', None],
+            'number': [1, 2, None], 'missing': [None, None, None]})
+
+    def test_token_scheduler(self):
+        import time
+        tokens = [OfflineToken(str(i) * 40) for i in range(3)]
+        reset = int(time.time()) + 100
+        for token, remaining in zip(tokens, (10, 4000, 3990)):
+            token.limits['core'] = {
+                'remaining': remaining, 'limit': 5000, 'reset': reset}
+        scheduler = stscraper.TokenScheduler(tokens)
+
+        # requests not yet reflected in limits are spread across tokens
+        picks = [scheduler.pick('repos/a/b')[0] for _ in range(20)]
+        self.assertEqual(picks[:10], [tokens[1]] * 10)
+        self.assertIn(tokens[2], picks[10:])
+        self.assertNotIn(tokens[0], picks)
+
+        # search limits are tracked separately
+        self.assertEqual(scheduler.pick('search/code')[1], 0)
+
+        # updated limits are respected
+        for token in tokens[1:]:
+            token.limits['core']['remaining'] = 0
+        self.assertIs(scheduler.pick('repos/a/b')[0], tokens[0])
+        tokens[0].limits['core']['remaining'] = 0
+        token, sleep = scheduler.pick('repos/a/b')
+        self.assertIsNone(token)
+        self.assertGreater(sleep, 90)
+
+    def test_token_scheduler_recovery(self):
+        import time
+        tokens = [OfflineToken(str(i) * 40) for i in range(3)]
+        reset = int(time.time()) + 100
+        for token in tokens:
+            token.limits['core'] = {
+                'remaining': 4000, 'limit': 5000, 'reset': reset}
+        scheduler = stscraper.TokenScheduler(tokens)
+        tokens[0].cool_down(0.2)
+        picks = [scheduler.pick('repos/a/b')[0] for _ in range(10)]
+        self.assertNotIn(tokens[0], picks)
+        time.sleep(0.25)
+        # the recovered token has the most quota left, so it goes first
+        picks = [scheduler.pick('repos/a/b')[0] for _ in range(4)]
+        self.assertEqual(picks, [tokens[0]] * 4)
+
+    def test_token_sessions(self):
+        import threading
+        token = OfflineToken('0' * 40)
+        created = []
+
+        def session_class():
+            created.append(FakeSession(lambda *args: make_response({})))
+            return created[-1]
+        token.session_class = session_class
+
+        # concurrent requests get different sessions
+        sessions = [token._checkout(), token._checkout()]
+        self.assertIsNot(sessions[0], sessions[1])
+        for session in sessions:
+            token._checkin(session)
+        # short-lived threads reuse idle sessions, and their connections
+        for _ in range(5):
+            thread = threading.Thread(target=token, args=('user',))
+            thread.start()
+            thread.join()
+        self.assertEqual(len(created), 2)
+
+    def test_read_ahead(self):
+        import time
+        produced = []
+
+        def pages():
+            for i in range(10):
+                produced.append(i)
+                yield i
+            raise ValueError("network is down")
+
+        pages_ahead = stscraper.read_ahead(pages(), 2)
+        self.assertEqual(next(pages_ahead), 0)
+        time.sleep(0.1)
+        # consumed + queued + the one waiting to be queued
+        self.assertLessEqual(len(produced), 4)
+        self.assertEqual(list(itertools.islice(pages_ahead, 9)),
+                         list(range(1, 10)))
+        self.assertRaises(ValueError, next, pages_ahead)
+
+    def test_bulk(self):
+        import threading
+        import time
+
+        class BulkAPI(stscraper.VCSAPI):
+            active = 0
+            max_active = 0
+            lock = threading.Lock()
+
+            def square(self, x):
+                with self.lock:
+                    self.active += 1
+                    self.max_active = max(self.max_active, self.active)
+                time.sleep(0.01 * (x % 3))
+                with self.lock:
+                    self.active -= 1
+                if x < 0:
+                    raise ValueError(x)
+                return x * x
+
+            def squares(self, x, n):
+                for _ in range(n):
+                    yield x * x
+
+        api = BulkAPI('key1')
+        res = list(api.bulk('square', [-1] + list(range(10)), concurrency=4))
+        self.assertEqual(sorted(arg for arg, _ in res), list(range(-1, 10)))
+        for arg, value in res:
+            if arg < 0:
+                self.assertIsInstance(value, ValueError)
+            else:
+                self.assertEqual(value, arg * arg)
+        self.assertLessEqual(api.max_active, 4)
+
+        res = list(api.bulk(api.squares, [(2, 2), (3, 1)], ordered=True))
+        self.assertEqual(res, [((2, 2), [4, 4]), ((3, 1), [9])])
+
+        # concurrency is capped by the remaining quota
+        api.max_active = 0
+        api.tokens[0].limits['core']['remaining'] = 1
+        list(api.bulk('square', range(10), concurrency=4))
+        self.assertEqual(api.max_active, 1)
+
 
 class TestGitHub(unittest.TestCase):
 
@@ -372,5 +592,757 @@ class TestGitHubv4(unittest.TestCase):
         self.assertRaises(stscraper.VCSError, stargazers)
 
 
+class TestGitHubv4Offline(unittest.TestCase):
+
+    def test_prefetch(self):
+        api = offline_api(OfflineGitHubAPIv4, '0' * 40)
+
+        def request(url, method='get', data=None, **params):
+            cursor = json.loads(data)['variables'].get('cursor') or 0
+            return make_response({'data': {'user': {'followers': {
+                'nodes': [{'login': 'user%d' % cursor}],
+                'pageInfo': {'endCursor': cursor + 1,
+                             'hasNextPage': cursor < 4}}}}})
+        api._request = request
+        query = '''query ($user: String!, $cursor: String) {
+              user(login: $user) {
+                followers(first:100, after:$cursor) {
+                  nodes { login }
+                  pageInfo{endCursor, hasNextPage}
+            }}}'''
+        followers = list(api.v4(query, user='user'))
+        self.assertEqual(len(followers), 5)
+        self.assertEqual(list(api.v4(query, prefetch=2, user='user')),
+                         followers)
+
+    def test_batch_repo_info(self):
+        api = offline_api(OfflineGitHubAPIv4, '0' * 40)
+        queries = []
+
+        def request(url, method='get', data=None, **params):
+            query = json.loads(data)['query']
+            queries.append(query)
+            data, errors = {}, []
+            repos = re.findall(r'(r\d+): repository\(owner: "(\w+)"', query)
+            for alias, owner in repos:
+                if owner == 'missing':
+                    data[alias] = None
+                    errors.append({'type': 'NOT_FOUND', 'path': [alias],
+                                   'message': 'Could not resolve'})
+                else:
+                    data[alias] = {'nameWithOwner': owner + '/repo'}
+            return make_response({'data': data, 'errors': errors})
+
+        api._request = request
+        slugs = ['a/repo', 'missing/repo', 'b/repo']
+        res = list(api.batch_repo_info(slugs, 'nameWithOwner', batch_size=2))
+        self.assertEqual(len(queries), 2)
+        self.assertEqual([slug for slug, _ in res], slugs)
+        self.assertEqual(res[0][1], {'nameWithOwner': 'a/repo'})
+        self.assertIsInstance(res[1][1], stscraper.RepoDoesNotExist)
+        self.assertEqual(res[2][1], {'nameWithOwner': 'b/repo'})
+
+        def invalid_query(*args, **kwargs):
+            return make_response({'errors': [{'message': 'Parse error'}]})
+        api._request = invalid_query
+        self.assertRaises(stscraper.VCSError,
+                          lambda: list(api.batch_repo_info(slugs)))
+
+
+class TestQuotaStore(unittest.TestCase):
+
+    def test_shared_limits(self):
+        import os
+        import shutil
+        import tempfile
+        import time
+        from stscraper.quota import SQLiteQuotaStore, token_id
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, 'quota.sqlite')
+            # same token used by two processes
+            token1, token2 = OfflineToken('0' * 40), OfflineToken('0' * 40)
+            token1.quota_store = SQLiteQuotaStore(path)
+            token2.quota_store = SQLiteQuotaStore(path)
+            reset = int(time.time()) + 100
+            token1._set_limits(
+                'core', {'remaining': 2, 'reset': reset, 'limit': 5000})
+            token2._sync_limits('core')
+            self.assertTrue(token2.ready('repos/a/b'))
+            self.assertEqual(token2.limits['core']['remaining'], 2)
+
+            store, key = token2.quota_store, token_id(token2.token)
+            self.assertTrue(store.claim(key, 'core'))
+            self.assertTrue(token1.quota_store.claim(key, 'core'))
+            self.assertFalse(store.claim(key, 'core'))
+            token1._sync_limits('core')
+            self.assertFalse(token1.ready('repos/a/b'))
+            # the store is read at most once in sync_interval seconds
+            token2._sync_limits('core')
+            self.assertTrue(token2.ready('repos/a/b'))
+            # the scheduler syncs limits before picking a token
+            token2.sync_interval = 0
+            scheduler = stscraper.TokenScheduler([token2])
+            self.assertIsNone(scheduler.pick('repos/a/b')[0])
+            # search limits are separate
+            self.assertTrue(token1.ready('search/code'))
+            # late responses don't increase remaining within the same window
+            token2._set_limits(
+                'core', {'remaining': 1, 'reset': reset, 'limit': 5000})
+            self.assertEqual(store.get(key, 'core')['remaining'], 0)
+            token1.quota_store.close()
+            store.close()
+        finally:
+            shutil.rmtree(tempdir)
+
+
+class TestSinks(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tempdir)
+
+    def test_csv_checkpoint(self):
+        import csv
+        import io
+        import os
+        from stscraper.sinks import CSVSink, Checkpoint
+        output = os.path.join(self.tempdir, 'out.csv')
+        done_path = os.path.join(self.tempdir, 'out.done')
+
+        with CSVSink(output, ('slug', 'topics')) as sink, \
+                Checkpoint(done_path, sink, flush_every=2) as done:
+            for slug in ('a/a', 'b/b', 'c/c'):
+                sink.write({'slug': slug, 'topics': ['x', 'y']})
+                done.add(slug)
+
+        # resume: existing file is appended, header is not repeated
+        with CSVSink(output, ('slug', 'topics')) as sink, \
+                Checkpoint(done_path, sink) as done:
+            self.assertEqual(len(done), 3)
+            self.assertIn('b/b', done)
+            self.assertNotIn('d/d', done)
+            sink.write({'slug': 'd/d'})
+            done.add('d/d')
+
+        with open(output) as fh:
+            rows = list(csv.reader(fh))
+        self.assertEqual(rows[0], ['slug', 'topics'])
+        self.assertEqual(rows[1], ['a/a', '["x", "y"]'])
+        self.assertEqual(rows[4], ['d/d', ''])
+        self.assertEqual(len(rows), 5)
+
+        with CSVSink(output, ('slug', 'topics')) as sink:
+            sink.write({'slug': u'caf\xe9/repo'})
+        with io.open(output, encoding='utf8') as fh:
+            self.assertEqual(fh.read().splitlines()[-1], u'caf\xe9/repo,')
+
+    def test_arrow_sink(self):
+        import os
+        from stscraper.sinks import ArrowSink
+        try:
+            import pyarrow.parquet as pq
+            import pyarrow.ipc
+        except ImportError:
+            return self.skipTest("pyarrow is not installed")
+        issues = [{'number': i, 'user': {'login': 'user%d' % i},
+                   'labels': [{'name': 'bug'}] * (i % 3),
+                   'closed_at': None if i < 15 else '2020-01-01'}
+                  for i in range(25)]
+        mapping = {'number': 'number', 'author': 'user__login',
+                   'labels': 'labels', 'closed_at': 'closed_at'}
+
+        path = os.path.join(self.tempdir, 'issues.parquet')
+        with ArrowSink(path, mapping, batch_size=10) as sink:
+            sink.write_all(iter(issues))
+        parquet = pq.ParquetFile(path)
+        self.assertEqual(parquet.metadata.num_row_groups, 3)
+        table = parquet.read()
+        self.assertEqual(table.num_rows, 25)
+        self.assertEqual(table.column('author')[3].as_py(), 'user3')
+        self.assertEqual(table.column('labels')[2].as_py(),
+                         [{'name': 'bug'}] * 2)
+        self.assertEqual(table.column('closed_at')[20].as_py(), '2020-01-01')
+
+        path = os.path.join(self.tempdir, 'issues.arrow')
+        with ArrowSink(path, mapping, fmt='arrow', batch_size=10) as sink:
+            sink.write_all(issues)
+        table = pyarrow.ipc.open_file(path).read_all()
+        self.assertEqual(table.num_rows, 25)
+
+        # types of empty lists are inferred from later batches
+        repos = [{'topics': [], 'labels': []}] * 3 + [
+            {'topics': [], 'labels': [{'name': 'bug'}]}]
+        path = os.path.join(self.tempdir, 'repos.parquet')
+        with ArrowSink(path, {'topics': 'topics', 'labels': 'labels'},
+                       batch_size=3) as sink:
+            sink.write_all(repos)
+        table = pq.read_table(path)
+        self.assertEqual(table.num_rows, 4)
+        self.assertEqual(table.schema.field('topics').type.value_type,
+                         pyarrow.string())
+        self.assertEqual(table.column('labels')[3].as_py(), [{'name': 'bug'}])
+
+        from stscraper.records import Commit
+        commits = [Commit('sha%d' % i, 'user', i, i, ('sha%d' % (i - 1),))
+                   for i in range(5)]
+        path = os.path.join(self.tempdir, 'commits.parquet')
+        with ArrowSink(path, {'sha': 'sha', 'author': 'author',
+                              'parents': 'parents'}) as sink:
+            sink.write_all(commits)
+        self.assertEqual(pq.read_table(path).to_pylist()[1], {
+            'sha': 'sha1', 'author': 'user', 'parents': ['sha0']})
+
+
+class TestIncremental(unittest.TestCase):
+
+    def test_marks(self):
+        from stscraper.incremental import IncrementalCrawler, SQLiteSyncState
+
+        class FakeAPI(object):
+            issues = [{'number': 1, 'updated_at': '2020-01-01T00:00:00Z'},
+                      {'number': 2, 'updated_at': '2020-02-01T00:00:00Z'}]
+            commits = [{'sha': 'c2'}, {'sha': 'c1'}]
+            events = [{'id': 20}, {'id': 10}]
+            since = []
+
+            def repo_issues(self, repo, since=None, **params):
+                self.since.append(since)
+                return iter([i for i in self.issues
+                             if since is None or i['updated_at'] >= since])
+
+            def repo_commits(self, repo):
+                return iter(self.commits)
+
+            def repo_issue_events(self, repo):
+                return iter(self.events)
+
+        api = FakeAPI()
+        crawler = IncrementalCrawler(api, SQLiteSyncState(':memory:'))
+
+        self.assertEqual(len(list(crawler.repo_issues('a/b'))), 2)
+        api.issues.append(
+            {'number': 3, 'updated_at': '2020-03-01T00:00:00Z'})
+        self.assertEqual([i['number'] for i in crawler.repo_issues('a/b')],
+                         [2, 3])
+        self.assertEqual(api.since, [None, '2020-02-01T00:00:00Z'])
+        # marks are per repository
+        self.assertEqual(len(list(crawler.repo_issues('c/d'))), 3)
+
+        self.assertEqual(len(list(crawler.repo_commits('a/b'))), 2)
+        api.commits.insert(0, {'sha': 'c3'})
+        self.assertEqual(list(crawler.repo_commits('a/b')), [{'sha': 'c3'}])
+        self.assertEqual(list(crawler.repo_commits('a/b')), [])
+
+        # interrupted crawls don't update the mark
+        next(crawler.repo_issue_events('a/b'))
+        self.assertEqual(len(list(crawler.repo_issue_events('a/b'))), 2)
+        api.events.insert(0, {'id': 30})
+        self.assertEqual(list(crawler.repo_issue_events('a/b')), [{'id': 30}])
+
+
+class FakeSession(object):
+    """ Replacement for APIToken.session serving responses from a handler """
+    def __init__(self, handler):
+        self.handler = handler
+
+    def request(self, method, url, params=None, data=None, headers=None,
+                timeout=None):
+        return self.handler(url, params or {}, headers or {})
+
+
+class TestCooldown(unittest.TestCase):
+
+    def test_secondary_limits(self):
+        import time
+        api = offline_api(OfflineGitHubAPI, ['1' * 40, '2' * 40])
+        calls = []
+
+        def handler(url, params, headers):
+            calls.append(headers['Authorization'])
+            limits = {'X-RateLimit-Remaining': '4000',
+                      'X-RateLimit-Reset': '2000000000',
+                      'X-RateLimit-Limit': '5000'}
+            if headers['Authorization'].endswith('1' * 40):
+                limits['Retry-After'] = '60'
+                return make_response({}, 403, limits)
+            return make_response({'full_name': 'user/repo'}, 200, limits)
+        for token in api.tokens:
+            token.session_class = lambda: FakeSession(handler)
+
+        started = time.time()
+        for _ in range(3):
+            self.assertEqual(api.repo_info('user/repo'),
+                             {'full_name': 'user/repo'})
+        # no sleeping, the throttled token is only used once
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual(len(calls), 4)
+        throttled = [t for t in api.tokens if t.token == '1' * 40][0]
+        self.assertFalse(throttled.ready('repos/user/repo'))
+        self.assertGreaterEqual(throttled.when('repos/user/repo'),
+                                started + 60)
+
+    def test_retries_per_token(self):
+        from stscraper.metrics import Metrics
+        tokens = [str(i) * 40 for i in range(1, 4)]
+        api = offline_api(OfflineGitHubAPI, tokens, metrics=Metrics(),
+                          retry_policy=stscraper.RetryPolicy(retries=1))
+        calls = []
+
+        def handler(url, params, headers):
+            calls.append(headers['Authorization'])
+            limits = {'X-RateLimit-Remaining': '4000',
+                      'X-RateLimit-Reset': '2000000000',
+                      'X-RateLimit-Limit': '5000'}
+            if not headers['Authorization'].endswith(tokens[2]):
+                return make_response({'message': 'Too many requests'},
+                                     429, limits)
+            return make_response({'full_name': 'user/repo'}, 200, limits)
+        for token in api.tokens:
+            token.session_class = lambda: FakeSession(handler)
+            # the token which is not throttled is picked last
+            token.limits['core'] = {
+                'remaining': 3000 if token.token == tokens[2] else 4000,
+                'limit': 5000, 'reset': 2000000000}
+
+        # two throttled tokens don't use up the retries of the request
+        self.assertEqual(api.repo_info('user/repo'),
+                         {'full_name': 'user/repo'})
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(api.metrics.counter('retries'), 2)
+        # nothing slept, throttled tokens cooled down instead
+        self.assertEqual(api.metrics.counter('backoff_seconds'), 0)
+
+    def test_forbidden(self):
+        api = offline_api(OfflineGitHubAPI, ['1' * 40, '2' * 40])
+        calls = []
+
+        def handler(url, params, headers):
+            calls.append(url)
+            limits = {'X-RateLimit-Remaining': '4000',
+                      'X-RateLimit-Reset': '2000000000',
+                      'X-RateLimit-Limit': '5000'}
+            if 'sso' in url:  # e.g. SAML enforcement
+                return make_response({'message': 'Resource protected by '
+                                                 'organization SAML'},
+                                     403, limits)
+            return make_response({'message': 'You have exceeded a secondary '
+                                             'rate limit'}, 403, limits)
+
+        for token in api.tokens:
+            token.session_class = lambda: FakeSession(handler)
+        import requests
+        self.assertRaises(requests.exceptions.HTTPError,
+                          api.repo_info, 'sso/repo')
+        # permission errors are not retried and don't throttle tokens
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(t.ready('repos/sso/repo') for t in api.tokens))
+
+        # secondary limits are retried, until retries are exhausted
+        api.retry_policy = stscraper.RetryPolicy(retries=0)
+        self.assertRaises(requests.exceptions.Timeout,
+                          api.repo_info, 'user/repo')
+        self.assertEqual(len(calls), 2)
+
+
+class TestCache(unittest.TestCase):
+
+    def test_conditional_requests(self):
+        from stscraper.cache import SQLiteCache
+        requests_made = []
+
+        def handler(url, params, headers):
+            requests_made.append(headers)
+            limits = {'X-RateLimit-Remaining': '4999',
+                      'X-RateLimit-Reset': '2000000000',
+                      'X-RateLimit-Limit': '5000'}
+            if headers.get('If-None-Match') == '"v1"':
+                return make_response(None, 304, limits)
+            limits['ETag'] = '"v1"'
+            return make_response({'full_name': url}, 200, limits)
+
+        api = offline_api(OfflineGitHubAPI, '1' * 40,
+                          cache=SQLiteCache(':memory:'))
+        api.tokens[0].session_class = lambda: FakeSession(handler)
+
+        info = api.repo_info('user/repo')
+        self.assertNotIn('If-None-Match', requests_made[-1])
+        self.assertEqual(api.repo_info('user/repo'), info)
+        self.assertEqual(requests_made[-1]['If-None-Match'], '"v1"')
+        # authorization header is still sent with conditional requests
+        self.assertIn('Authorization', requests_made[-1])
+
+    def test_lru_eviction(self):
+        from stscraper.cache import CompactLRUCache
+        cache = CompactLRUCache(max_entries=3)
+        for i in range(5):
+            cache.set(i, {'id': i})
+        self.assertEqual(len(cache), 3)
+        self.assertIsNone(cache.get(0))
+        self.assertEqual(cache.get(4), {'id': 4})
+        self.assertEqual(cache.stats()['evictions'], 2)
+
+        cache = CompactLRUCache(max_bytes=cache.sizeof(cache.encode({})) * 4)
+        for i in range(10):
+            cache.set(i, {})
+        self.assertLessEqual(cache.stats()['bytes'], cache.max_bytes)
+        self.assertEqual(cache.get(9), {})
+
+        # nested values are counted, too
+        from stscraper.cache import LRUCache
+        repo = {'owner': {'login': 'user' * 100}, 'topics': ['a' * 1000]}
+        self.assertGreater(LRUCache.sizeof(repo), 1500)
+        cache = LRUCache(max_bytes=LRUCache.sizeof(repo) * 3)
+        for i in range(10):
+            cache.set(i, dict(repo, id=i))
+        self.assertLessEqual(len(cache), 3)
+
+
+class TestPagination(unittest.TestCase):
+
+    def setUp(self):
+        self.api = offline_api(OfflineGitHubAPI, '2' * 40)
+
+        def handler(url, params, headers):
+            page = params['page']
+            link = {'Link': '<%s?page=%d>; rel="next", '
+                            '<%s?page=5>; rel="last"' % (url, page + 1, url)}
+            issues = [{'number': page * 10 + i} for i in range(3)]
+            return make_response(issues, headers=link if page < 5 else {})
+        self.api.tokens[0].session_class = lambda: FakeSession(handler)
+
+    def test_prefetch(self):
+        issues = list(self.api.repo_issues('user/repo'))
+        self.assertEqual(len(issues), 15)
+        self.assertEqual(list(self.api.repo_issues('user/repo', prefetch=2)),
+                         issues)
+
+    def test_parallel_pages(self):
+        issues = list(self.api.repo_issues('user/repo'))
+        self.assertEqual(
+            list(self.api.repo_issues('user/repo', concurrency=4)), issues)
+        unordered = self.api.repo_issues(
+            'user/repo', concurrency=4, ordered=False)
+        self.assertEqual(sorted(i['number'] for i in unordered),
+                         [i['number'] for i in issues])
+
+    def test_fields(self):
+        fields = {'id': 'number'}
+        # repo_issues() filter is applied before projection
+        issues = [{'id': i['number']}
+                  for i in self.api.repo_issues('user/repo')]
+        self.assertEqual(
+            list(self.api.repo_issues('user/repo', fields=fields)), issues)
+        self.assertEqual(list(self.api.repo_issues(
+            'user/repo', fields=fields, concurrency=4)), issues)
+        self.assertEqual(list(self.api.request(
+            'repos/user/repo/issues', paginate=True,
+            fields=lambda issue: issue['number'])),
+            [i['id'] for i in issues])
+
+
+class TestMockServer(unittest.TestCase):
+
+    def setUp(self):
+        from stscraper.mockserver import MockGitHub
+        self.server = MockGitHub(items=250, quota=10).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_rest(self):
+        api = self.server.api(stscraper.GitHubAPI, tokens=2)
+        self.assertEqual(len(api.tokens), 2)
+        self.assertEqual(len(list(api.repo_commits('user/repo'))), 250)
+        self.assertEqual(api.repo_info('user/repo')['full_name'], 'user/repo')
+        self.assertRaises(stscraper.RepoDoesNotExist,
+                          api.repo_info, 'user/missing')
+        # 2 token validations + 3 pages + 2 repo_info
+        self.assertEqual(self.server.requests, 7)
+        remaining = [t.limits['core']['remaining'] for t in api.tokens]
+        self.assertEqual(sum(remaining), 20 - 7)
+        # the scheduler balances load across tokens
+        self.assertLessEqual(abs(remaining[0] - remaining[1]), 1)
+
+    def test_v4(self):
+        api = self.server.api(stscraper.GitHubAPIv4)
+        self.assertEqual(len(list(api.user_followers('user'))), 250)
+        self.assertEqual(api.user_info('user')['login'], 'user')
+        res = dict(api.batch_repo_info(['a/b', 'a/missing']))
+        self.assertEqual(res['a/b']['nameWithOwner'], 'a/b')
+        self.assertIsInstance(res['a/missing'], stscraper.RepoDoesNotExist)
+
+    def test_token_validation(self):
+        from stscraper.quota import SQLiteQuotaStore
+        store = SQLiteQuotaStore(':memory:')
+        api = self.server.api(stscraper.GitHubAPI, tokens=4,
+                              quota_store=store)
+        self.assertEqual(len(api.tokens), 4)
+        self.assertEqual(self.server.requests, 4)
+        # owners are remembered, so the next process doesn't check them
+        api = self.server.api(stscraper.GitHubAPI, tokens=4,
+                              quota_store=store)
+        self.assertEqual(self.server.requests, 4)
+        self.assertEqual(sorted(token.user for token in api.tokens),
+                         ['mock-user-%04d' % i for i in range(4)])
+        self.assertEqual(api.tokens[0].limits['core']['remaining'], None)
+        # shared limits are loaded before a token is picked
+        self.assertIsNotNone(api.scheduler.pick('repos/a/b')[0])
+        self.assertEqual(api.tokens[0].limits['core']['remaining'], 9)
+
+    def test_retries(self):
+        import requests
+        from stscraper.metrics import Metrics
+        from stscraper.retry import RetryPolicy
+        metrics = Metrics()
+        api = self.server.api(stscraper.GitHubAPI, tokens=2, metrics=metrics,
+                              retry_policy=RetryPolicy(base=0.001, cap=0.01))
+        self.server.error_rate = 0.5
+        self.server.random.seed(0)
+        self.assertEqual(len(list(api.repo_commits('user/repo'))), 250)
+        self.assertGreater(metrics.counter('retries', reason='server_error'),
+                           0)
+
+        # give up after repeated failures, and stop trying for a while
+        self.server.error_rate = 1
+        api.retry_policy = RetryPolicy(
+            retries=1, base=0.001, breaker_threshold=2)
+        self.assertRaises(requests.exceptions.Timeout,
+                          api.repo_info, 'user/repo')
+        self.assertRaises(stscraper.CircuitOpen, api.repo_info, 'user/repo')
+
+    def test_dedup(self):
+        import threading
+        from stscraper.cache import LRUCache
+        self.server.latency = 0.05
+        api = self.server.api(stscraper.GitHubAPI, dedup=LRUCache(ttl=60))
+        requests_made = self.server.requests
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            api.user_info('user'))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [{'login': 'user', 'type': 'User'}] * 8)
+        self.assertEqual(api.user_info('user', fields={'name': 'login'}),
+                         {'name': 'user'})
+        self.assertRaises(stscraper.RepoDoesNotExist,
+                          api.repo_info, 'user/missing')
+        self.assertEqual(self.server.requests - requests_made, 2)
+        stats = api.dedup.stats()
+        self.assertEqual((stats['misses'], stats['hits'] + stats['coalesced']),
+                         (2, 8))
+        # paginated requests are not cached
+        list(api.repo_commits('user/repo'))
+        list(api.repo_commits('user/repo'))
+        self.assertEqual(self.server.requests - requests_made, 8)
+
+    def test_memo(self):
+        from stscraper.cache import CompactLRUCache
+        api = self.server.api(stscraper.GitHubAPI, memo=CompactLRUCache())
+        requests_made = self.server.requests
+        for _ in range(3):
+            info = api.repo_info('user/repo')
+            self.assertEqual(info['full_name'], 'user/repo')
+            info['full_name'] = 'modified'  # callers get their own copies
+            self.assertEqual(api.repo_topics('user/repo'), ('mock', 'topic'))
+            self.assertEqual(len(api.repo_labels('user/repo')), 250)
+        self.assertEqual(api.repo_info('user/repo', fields={'n': 'name'}),
+                         {'n': 'repo'})
+        # repo_info, repo_topics and 3 pages of labels
+        self.assertEqual(self.server.requests - requests_made, 5)
+        stats = api.memo.stats()
+        self.assertEqual((stats['misses'], stats['hits']), (3, 7))
+
+        # missing repositories are remembered, too
+        requests_made = self.server.requests
+        for _ in range(2):
+            self.assertRaises(stscraper.RepoDoesNotExist,
+                              api.repo_info, 'user/missing')
+        self.assertEqual(self.server.requests - requests_made, 1)
+
+    def test_records(self):
+        from stscraper.records import Commit, Issue, Stargazer, timestamp
+        self.assertEqual(timestamp('2020-01-01T00:00:00Z'), 1577836800)
+        api = self.server.api(stscraper.GitHubAPI)
+        commits = list(api.repo_commits('user/repo', fields=Commit.from_json))
+        self.assertEqual(len(commits), 250)
+        self.assertEqual(commits[0], Commit(
+            'sha-250', 'user50', 1500000250, None, ('sha-249',)))
+        self.assertEqual(commits[0].get('author'), 'user50')
+        self.assertIsNone(commits[0].get('missing'))
+        # logins are shared between records
+        self.assertIs(commits[0].author, commits[100].author)
+        issues = list(api.repo_issues('user/repo', fields=Issue.from_json))
+        self.assertEqual(issues[-1].to_dict(), {
+            'number': 1, 'author': 'user1', 'state': None,
+            'title': 'Item 1 of user/repo', 'created_at': 1500000001,
+            'updated_at': 1500000001, 'closed_at': None})
+        self.assertEqual(
+            next(api.repo_stargazers('user/repo', fields=Stargazer.from_json)),
+            Stargazer('login-250', None))
+        self.assertEqual(Stargazer.from_json(
+            {'starred_at': '2020-01-01T00:00:00Z', 'user': {'login': 'a'}}),
+            Stargazer('a', 1577836800))
+
+    def test_get_limits(self):
+        api = self.server.api(stscraper.GitHubAPI, tokens=3)
+        limits = list(stscraper.github.get_limits(api=api))
+        self.assertEqual(len(limits), 3)
+        self.assertEqual({row['core_remaining'] for row in limits}, {9})
+        self.assertTrue(all(row['user'].startswith('mock-user-')
+                            for row in limits))
+
+        # without refresh, only limits known from headers are reported
+        for token in api.tokens:
+            token.check_limits = lambda: self.fail("rate_limit was called")
+        list(api.repo_commits('user/repo'))
+        limits = list(stscraper.github.get_limits(api=api, refresh=False))
+        self.assertEqual(sum(row['core_remaining'] for row in limits), 24)
+
+    def test_metrics(self):
+        from stscraper.metrics import Metrics, endpoint_class
+        self.assertEqual(endpoint_class('repos/a/b/issues/12/comments'),
+                         'repos/:owner/:repo/issues/:id/comments')
+        metrics = Metrics()
+        events = []
+        metrics.add_listener(lambda *args: events.append(args))
+        api = self.server.api(stscraper.GitHubAPI, metrics=metrics)
+        self.assertEqual(len(list(api.repo_commits('user/repo'))), 250)
+        self.assertEqual(metrics.counter('responses', status=200), 3)
+        self.assertEqual(metrics.counter('token_requests'), 3)
+        self.assertGreater(metrics.counter('received_bytes'), 0)
+        self.assertEqual(len(events), 3 * 5)  # 4 per response + decoding
+        text = metrics.prometheus()
+        self.assertIn('stscraper_request_seconds_count'
+                      '{endpoint="repos/:owner/:repo/commits"} 3', text)
+        self.assertIn('# TYPE stscraper_responses counter', text)
+        self.assertIn('request_seconds endpoint=repos/:owner/:repo/commits',
+                      metrics.summary())
+
+
+@unittest.skipIf(sys.version_info < (3, 6), "asyncio API requires Python 3.6+")
+class TestAsync(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            import httpx
+            from stscraper.aio import AsyncGitHubAPI
+        except ImportError:
+            self.skipTest("httpx is not installed")
+        self.calls = []
+
+        def handler(request):
+            self.calls.append(request)
+            headers = {'X-RateLimit-Remaining': '4999',
+                       'X-RateLimit-Reset': '2000000000',
+                       'X-RateLimit-Limit': '5000'}
+            page = int(request.url.params.get('page', 0))
+            if request.url.path == '/repos/user/repo':
+                if request.headers.get('If-None-Match') == '"v1"':
+                    return httpx.Response(304, headers=headers)
+                headers['ETag'] = '"v1"'
+                return httpx.Response(200, json={'full_name': 'user/repo'},
+                                      headers=headers)
+            if request.url.path == '/repos/user/repo/issues':
+                if page == 1:
+                    headers['Link'] = '<https://api.github.com/repos/user/' \
+                                      'repo/issues?page=2>; rel="next"'
+                issues = [{'number': page}, {'number': 10 + page,
+                                             'pull_request': {}}]
+                return httpx.Response(200, json=issues, headers=headers)
+            return httpx.Response(404, json={}, headers=headers)
+
+        self.api = offline_api(OfflineGitHubAPI, '0' * 40)
+        self.aapi = AsyncGitHubAPI(
+            api=self.api,
+            client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def _list(self, agen):
+        items = []
+        while True:
+            try:
+                items.append(self._run(agen.__anext__()))
+            except StopAsyncIteration:
+                return items
+
+    def test_api_methods(self):
+        info = self._run(self.aapi.repo_info('user/repo'))
+        self.assertEqual(info, {'full_name': 'user/repo'})
+        self.assertEqual(
+            self.calls[0].headers['Authorization'], 'token ' + '0' * 40)
+        self.assertEqual(self.api.tokens[0].limits['core']['remaining'], 4999)
+
+        # pull requests are filtered out, same as in GitHubAPI
+        self.assertEqual(self._list(self.aapi.repo_issues('user/repo')),
+                         [{'number': 1}, {'number': 2}])
+
+        self.assertRaises(stscraper.RepoDoesNotExist,
+                          self._run, self.aapi.repo_info('user/nonexistent'))
+
+    def test_quota_store(self):
+        from stscraper.quota import QuotaStore
+        claims = []
+
+        class Store(QuotaStore):
+            def get(self, token, api_class):
+                return None
+
+            def update(self, token, api_class, limits):
+                pass
+
+            def claim(self, token, api_class):
+                claims.append(api_class)
+                return True
+
+        self.api.tokens[0].quota_store = Store()
+        self._run(self.aapi.repo_info('user/repo'))
+        self.assertEqual(claims, ['core'])
+
+    def test_unknown_method(self):
+        self.assertRaises(AttributeError, lambda: self.aapi.repo_topics)
+
+    def test_cache(self):
+        import asyncio
+        from stscraper.cache import CompactLRUCache, LRUCache, SQLiteCache
+        self.api.cache = SQLiteCache(':memory:')
+        info = self._run(self.aapi.repo_info('user/repo'))
+        self.assertEqual(self._run(self.aapi.repo_info('user/repo')), info)
+        self.assertEqual(self.calls[-1].headers['If-None-Match'], '"v1"')
+        self.assertEqual(len(self.calls), 2)
+
+        # concurrent calls are coalesced, and results are cached
+        self.api.dedup = LRUCache()
+        tasks = [self.loop.create_task(
+            self.aapi.repo_info('user/repo', concurrency=4))
+            for _ in range(5)]
+        self.assertEqual(self._run(asyncio.gather(*tasks)), [info] * 5)
+        self.assertEqual(len(self.calls), 3)
+
+        # memoized results are shared with the synchronous interface
+        self.api.memo = CompactLRUCache()
+        self.api.dedup = None
+        info = self._run(self.aapi.repo_info('user/repo',
+                                             fields={'name': 'full_name'}))
+        self.assertEqual(info, {'name': 'user/repo'})
+        self.assertEqual(self.api.repo_info('user/repo'),
+                         {'full_name': 'user/repo'})
+        self.assertEqual(len(self.calls), 4)
+
+
 if __name__ == "__main__":
     unittest.main()